@@ -12,7 +12,7 @@ from flask_cors import CORS
 from bing_image_downloader import downloader
 
 # import the SQLAlchemy and database support modules
-from models_database import db, ShopData, ShopData_Product
+from models_database import db, ShopData, ShopData_Product, to_price, to_stock
 
 # import openai
 import openai
@@ -563,30 +563,14 @@ def predict(Data=ShopData, DataProduct=ShopData_Product, db=db, tools=tools):
     print(response_text, 'dataresponse')
 
     # get the time just after the query is done
-    time_now = datetime.datetime.now().strftime("%I:%M:%S%p-%B-%d-%Y")
+    time_now = datetime.datetime.now(datetime.timezone.utc)
 
-    # Code and ID generator
+    # Code generator, the IDs are generated by the identity columns of the database
     code_str = ''.join(random.choice(string.ascii_letters)
                        for i in range(16))
 
-    id = random.randint(0, 100000)
-
-    file_ids_r = open("./ids.txt", "r")
-    lst = []
-    for line in file_ids_r:
-        lst.append(int(line.strip()))
-
-    # check if the ids are repeated
-    while id in lst:
-        id = random.randint(0, 100000)
-
-    # create file with new ids to save in the database
-    with open("./ids.txt", "a+") as file_ids:
-        file_ids.write(str(id) + '\n')
-
     # fill the database item values
     register = Data(
-        id=id,
         code=code_str,
         date=time_now,
         username=username,
@@ -599,31 +583,15 @@ def predict(Data=ShopData, DataProduct=ShopData_Product, db=db, tools=tools):
     # add the second table with the product information
     if product_query is True:
 
-        id_table = random.randint(0, 100000)
-
-        file_ids_product = open("./ids_products.txt", "r")
-        lst = []
-        for line in file_ids_product:
-            lst.append(int(line.strip()))
-
-        # check if the ids are repeated
-        while id_table in lst:
-            id_table = random.randint(0, 100000)
-
-        # create file with new ids to save in the database
-        with open("./ids_products.txt", "a+") as file_ids_product:
-            file_ids_product.write(str(id_table) + '\n')
-
         # fill the product table item values
         register_product = DataProduct(
-            id=id_table,
             code=code_str,
             date=time_now,
             username=username,
             product_name=product_name_def,
-            price=price_def,
+            price=to_price(price_def),
             description=description_def,
-            stock_availability=stock_availability_def)
+            stock_availability=to_stock(stock_availability_def))
 
         # add a new register to the new product table in database
         db.session.add(register_product)
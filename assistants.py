@@ -0,0 +1,148 @@
+"""
+This assistants.py code contains the registry of the GPT assistant used by
+the ShopBot API. The assistant is identified by a fingerprint of its name,
+instructions, model and tools, so it is created only once and reused by every
+chatbot session and process. A new assistant is only created when its
+definition (e.g. the tool schema) changes. The ID of the assistant is kept in
+a local file, and only the newest pages of the assistants of the account are
+searched when the file does not know it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import openai
+
+# metadata key holding the fingerprint of the assistant definition
+FINGERPRINT_KEY = 'shopbot_fingerprint'
+
+
+def assistant_fingerprint(name=None, instructions=None, model=None, tools=None):
+    """
+    This function computes the fingerprint of an assistant definition.
+
+    :param name (Optional[str]): The name of the assistant.
+    :param instructions (Optional[str]): The instructions of the assistant.
+    :param model (Optional[str]): The GPT model of the assistant.
+    :param tools (Optional[List[dict]]): The tools definition of the assistant.
+
+    :return str: The hexadecimal SHA-256 fingerprint of the definition.
+    """
+
+    definition = json.dumps(
+        {'name': name, 'instructions': instructions, 'model': model, 'tools': tools},
+        sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(definition.encode('utf-8')).hexdigest()
+
+
+class AssistantRegistry:
+    """
+    This class returns the GPT assistant of the API, creating it only if no assistant with the
+    same definition exists yet.
+    """
+
+    def __init__(
+            self,
+            client=None,
+            name=None,
+            instructions=None,
+            model=None,
+            tools=None,
+            path='./assistant_ids.json',
+            max_lookup_pages=3):
+        """
+        :param client (Optional[OpenAI]): The OpenAI client.
+        :param name (Optional[str]): The name of the assistant.
+        :param instructions (Optional[str]): The instructions of the assistant.
+        :param model (Optional[str]): The GPT model of the assistant.
+        :param tools (Optional[List[dict]]): The tools definition of the assistant.
+        :param path (Optional[str]): The JSON file keeping the assistant ID of each fingerprint,
+        None to only look the assistants up in the OpenAI account.
+        :param max_lookup_pages (int): The maximum number of pages of 100 assistants of the
+        account searched, newest first, for an assistant with the same definition.
+        """
+
+        self.client = client
+        self.name = name
+        self.instructions = instructions
+        self.model = model
+        self.tools = tools
+        self.path = path
+        self.max_lookup_pages = max_lookup_pages
+        self.fingerprint = assistant_fingerprint(
+            name=name, instructions=instructions, model=model, tools=tools)
+        self._lock = threading.Lock()
+        self._assistant = None
+
+    def _read_ids(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as file_ids:
+                return json.load(file_ids)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_id(self, assistant_id):
+        if self.path is None:
+            return
+        ids = self._read_ids()
+        ids[self.fingerprint] = assistant_id
+        path_tmp = self.path + '.tmp'
+        with open(path_tmp, 'w') as file_ids:
+            json.dump(ids, file_ids)
+        os.replace(path_tmp, self.path)
+
+    def _retrieve(self, assistant_id):
+        try:
+            return self.client.beta.assistants.retrieve(assistant_id)
+        except openai.NotFoundError:
+            return None
+
+    def _lookup(self):
+        # look for the stored ID of this fingerprint first
+        assistant_id = self._read_ids().get(self.fingerprint)
+        if assistant_id:
+            assistant = self._retrieve(assistant_id)
+            if assistant is not None:
+                return assistant
+
+        # then for a recent assistant of the account tagged with this fingerprint,
+        # without walking every (possibly orphan) assistant of the account
+        page = self.client.beta.assistants.list(limit=100, order='desc')
+        for _ in range(0, self.max_lookup_pages):
+            for assistant in page.data:
+                if (assistant.metadata or {}).get(FINGERPRINT_KEY) == self.fingerprint:
+                    self._write_id(assistant.id)
+                    return assistant
+            if not page.has_next_page():
+                break
+            page = page.get_next_page()
+        return None
+
+    def get(self):
+        """
+        This function returns the GPT assistant, creating it the first time it is requested if
+        there is no assistant with the same definition.
+
+        :return Assistant: The GPT assistant object.
+        """
+
+        if self._assistant is not None:
+            return self._assistant
+
+        with self._lock:
+            if self._assistant is None:
+                assistant = self._lookup()
+                if assistant is None:
+                    assistant = self.client.beta.assistants.create(
+                        name=self.name,
+                        instructions=self.instructions,
+                        model=self.model,
+                        tools=self.tools,
+                        metadata={FINGERPRINT_KEY: self.fingerprint})
+                    self._write_id(assistant.id)
+                self._assistant = assistant
+        return self._assistant
@@ -0,0 +1,212 @@
+"""
+This caching.py code contains the in-process caches used by the ShopBot API.
+The LRUTTLCache is a thread-safe least recently used cache whose entries also
+expire after a time to live, so its memory stays bounded with many chats.
+The ProductResponseCache keeps the rendered answer of the product queries of
+each catalog, so a repeated query skips the catalog lookup, the GPT tools and
+the image request.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    """
+    This class is a thread-safe LRU cache with a time to live for every entry.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=3600, clock=time.monotonic):
+        """
+        :param max_size (int): The maximum number of entries, the least recently used entry is
+        evicted when it is exceeded.
+        :param ttl_seconds (Optional[float]): The time to live of the entries in seconds, None
+        for entries that never expire.
+        :param clock (Callable[[], float]): The clock used for the expiration times.
+        """
+
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def _expired(self, expires):
+        return expires is not None and self.clock() >= expires
+
+    def get(self, key, default=None):
+        """
+        This function returns the value of a key and marks it as recently used.
+
+        :param key: The key of the entry.
+        :param default: The value returned if the key is missing or expired.
+
+        :return: The cached value or the default value.
+        """
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if self._expired(expires):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        """
+        This function stores the value of a key, evicting the least recently used entries.
+
+        :param key: The key of the entry.
+        :param value: The value to store.
+        :param ttl_seconds (Optional[float]): The time to live of this entry, by default the
+        time to live of the cache.
+        """
+
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires = None if ttl is None else self.clock() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        This function removes a key from the cache.
+
+        :param key: The key of the entry.
+        :param default: The value returned if the key is missing or expired.
+
+        :return: The removed value or the default value.
+        """
+
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or self._expired(entry[1]):
+            return default
+        return entry[0]
+
+    def discard(self, predicate=None):
+        """
+        This function removes the entries whose key satisfies a predicate.
+
+        :param predicate (Callable[[object], bool]): The function called with each key.
+
+        :return int: The number of removed entries.
+        """
+
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        """
+        This function removes every entry of the cache.
+        """
+
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, default=None) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class ProductResponseCache:
+    """
+    This class caches the response of the product queries by (catalog fingerprint, normalized
+    product name), with LRU and TTL eviction and hit/miss counters. An entry of a catalog is
+    never returned for another catalog, and the entries of a catalog can be invalidated.
+    """
+
+    def __init__(self, max_size=2048, ttl_seconds=900, clock=time.monotonic):
+        """
+        :param max_size (int): The maximum number of cached responses, 0 disables the cache.
+        :param ttl_seconds (Optional[float]): The time to live of the responses in seconds.
+        :param clock (Callable[[], float]): The clock used for the expiration times.
+        """
+
+        self.enabled = max_size > 0
+        self._cache = LRUTTLCache(
+            max_size=max(max_size, 1), ttl_seconds=ttl_seconds, clock=clock)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(catalog=None, product_name=None):
+        # case-folded product name with single spaces
+        return catalog.fingerprint, ' '.join(str(product_name or '').casefold().split())
+
+    def get(self, catalog=None, product_name=None):
+        """
+        This function returns the cached response of a product query.
+
+        :param catalog (Optional[Catalog]): The catalog of the session.
+        :param product_name (Optional[str]): The queried product name.
+
+        :return Optional[Tuple]: The cached response, or None on a miss.
+        """
+
+        if not self.enabled:
+            return None
+        value = self._cache.get(self.key(catalog, product_name))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, catalog=None, product_name=None, response=None):
+        """
+        This function stores the response of a product query.
+
+        :param catalog (Optional[Catalog]): The catalog of the session.
+        :param product_name (Optional[str]): The queried product name.
+        :param response (Optional[Tuple]): The response to cache.
+        """
+
+        if self.enabled:
+            self._cache.set(self.key(catalog, product_name), response)
+
+    def invalidate(self, catalog=None):
+        """
+        This function removes the cached responses of a catalog, or every response if no catalog
+        is given.
+
+        :param catalog (Optional[Catalog]): The catalog whose responses are removed.
+
+        :return int: The number of removed responses.
+        """
+
+        if catalog is None:
+            size = len(self._cache)
+            self._cache.clear()
+            return size
+        return self._cache.discard(lambda key: key[0] == catalog.fingerprint)
+
+    def stats(self):
+        """
+        This function returns the counters of the cache.
+
+        :return dict: The hits, misses, hit ratio and size of the cache.
+        """
+
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'size': len(self._cache)}
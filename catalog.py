@@ -0,0 +1,244 @@
+"""
+This catalog.py code contains the in-memory Catalog object for the Mock
+JSON catalog generated in the ShopBot API. The catalog is parsed once when
+the chatbot session starts (in /ini) and indexed, so the helpers of the API
+never re-parse the JSON string or scan the product list on every request.
+The product fields requested by the getInformation and checkStock tools
+(price, description and stock_avail) are resolved here without any GPT run.
+"""
+
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+# tokens used by the inverted index of the catalog
+TOKEN_PATTERN = re.compile(r'[0-9a-z]+')
+
+
+def tokenize(text=None):
+    """
+    This function splits a text in case-folded alphanumeric tokens.
+
+    :param text (Optional[str]): The text to split.
+
+    :return List[str]: The list of tokens.
+    """
+
+    return TOKEN_PATTERN.findall(str(text or '').casefold())
+
+
+class ProductRecord:
+    """
+    This class is a compact record of a single product in the Mock catalog.
+    """
+
+    __slots__ = ('product_name', 'description', 'price', 'stock_avail', 'key')
+
+    def __init__(self, product_name, description, price, stock_avail):
+        self.product_name = product_name
+        self.description = description
+        self.price = price
+        self.stock_avail = stock_avail
+        self.key = product_name.strip().casefold()
+
+    def fields(self):
+        """
+        This function returns the price, description and stock_avail values of the product as
+        strings, or None if any of them is missing in the catalog.
+
+        :return Optional[Tuple[str, str, str]]: The price, the description, and the stock_avail value.
+        """
+
+        values = (self.price, self.description, self.stock_avail)
+        for value in values:
+            if value is None or str(value).strip() == '':
+                return None
+        return tuple(str(value) for value in values)
+
+    def __repr__(self):
+        return f'<product {self.product_name}>'
+
+
+class Catalog:
+    """
+    This class holds the parsed Mock catalog with the indexes used by the ShopBot API:
+    a case-folded product_name hash index, a token inverted index, and the precomputed
+    HTML fragment with the product list shown in the chatbot.
+    """
+
+    __slots__ = ('raw', 'fingerprint', 'products', 'names', 'product_list_html',
+                 '_name_index', '_token_index', '_matcher')
+
+    def __init__(self, products=None, raw=None):
+        """
+        :param products (Optional[List[dict]]): The list of product dictionaries of the catalog,
+        each one with the 'product_name', 'description', 'price' and 'stock_avail' keys.
+        :param raw (Optional[str]): The JSON string of the catalog as it is sent to the GPT thread.
+        """
+
+        self.products = tuple(
+            ProductRecord(
+                product_name=str(product['product_name']),
+                description=product.get('description'),
+                price=product.get('price'),
+                stock_avail=product.get('stock_avail'))
+            for product in products or [])
+        self.raw = raw if raw is not None else json.dumps(products or [])
+        # the catalog changes if and only if its JSON string changes
+        self.fingerprint = hashlib.sha1(self.raw.encode('utf-8')).hexdigest()
+        self.names = tuple(record.product_name for record in self.products)
+        self.product_list_html = ''.join(
+            '<b>-' + name + '</b><br>' for name in self.names)
+
+        # case-folded name -> product positions (more than one if duplicated)
+        self._name_index = {}
+        # token -> product positions
+        self._token_index = {}
+        for position, record in enumerate(self.products):
+            self._name_index.setdefault(record.key, []).append(position)
+            for token in set(tokenize(record.product_name)):
+                self._token_index.setdefault(token, set()).add(position)
+
+        self._matcher = None
+
+    @classmethod
+    def from_json(cls, mock_products=None):
+        """
+        This function builds the Catalog object from the JSON string of the Mock catalog.
+
+        :param mock_products (Optional[str]): A JSON string of a list of dictionaries with the
+        Mock catalog, where each dictionary contains the 'product_name' key.
+
+        :return Catalog: The parsed and indexed catalog.
+        """
+
+        return cls(products=json.loads(mock_products), raw=mock_products)
+
+    def __len__(self):
+        return len(self.products)
+
+    @property
+    def matcher(self):
+        """
+        This property returns the local fuzzy matcher over the product names of the catalog.
+        The matcher index is built the first time it is used.
+
+        :return ProductMatcher: The product name matcher of the catalog.
+        """
+
+        if self._matcher is None:
+            from matcher import ProductMatcher
+            self._matcher = ProductMatcher(product_names=self.names)
+        return self._matcher
+
+    def get(self, product_name=None):
+        """
+        This function returns the product with exactly this case-insensitive product_name.
+
+        :param product_name (Optional[str]): The product name to look for.
+
+        :return Optional[ProductRecord]: The product, or None if it is not found or duplicated.
+        """
+
+        positions = self._name_index.get(str(product_name or '').strip().casefold())
+        if positions is None or len(positions) != 1:
+            return None
+        return self.products[positions[0]]
+
+    def _substring_matches(self, product_name=None):
+        """
+        This function returns the positions of the products whose product_name contains the
+        given case-insensitive text. The token index narrows the candidates with the inner
+        tokens of the text, since only the first and the last tokens can be partial words.
+        """
+
+        name_query = str(product_name or '').strip().casefold()
+        if not name_query:
+            return []
+
+        candidates = None
+        for token in tokenize(name_query)[1:-1]:
+            postings = self._token_index.get(token, set())
+            candidates = set(postings) if candidates is None else candidates & postings
+
+        if candidates is None:
+            candidates = range(len(self.products))
+
+        return sorted(position for position in candidates
+                      if name_query in self.products[position].key)
+
+    def contains(self, product_name=None):
+        """
+        This function validates if the product_name given by the getProductInfo tool is part
+        of any product_name in the catalog.
+
+        :param product_name (Optional[str]): The product name to validate.
+
+        :return bool: True if the product name is in the catalog.
+        """
+
+        if str(product_name or '').strip().casefold() in self._name_index:
+            return True
+        return len(self._substring_matches(product_name=product_name)) > 0
+
+    def find(self, product_name=None):
+        """
+        This function finds the single product that matches the product_name given by the
+        getProductInfo tool. An exact case-insensitive match is preferred, otherwise a
+        case-insensitive substring match is accepted only if it is unique.
+
+        :param product_name (Optional[str]): The product name confirmed by the getProductInfo tool.
+
+        :return Optional[ProductRecord]: The matched product, or None if the name is missing,
+        not found, or ambiguous.
+        """
+
+        if not product_name:
+            return None
+
+        key = str(product_name).strip().casefold()
+        if key in self._name_index:
+            return self.get(product_name=product_name)
+
+        positions = self._substring_matches(product_name=product_name)
+        if len(positions) == 1:
+            return self.products[positions[0]]
+        return None
+
+
+@lru_cache(maxsize=256)
+def load_catalog(mock_products=None):
+    """
+    This function returns the parsed Catalog object of a Mock catalog JSON string. The catalogs
+    are cached per process, so a session only parses its catalog once in each worker.
+
+    :param mock_products (Optional[str]): A JSON string with the Mock catalog.
+
+    :return Catalog: The parsed and indexed catalog.
+    """
+
+    return Catalog.from_json(mock_products=mock_products)
+
+
+def resolve_product_fields(product_name=None, catalog=None):
+    """
+    This function resolves the price, description and stock availability of a product
+    directly from the Mock catalog, replacing the getInformation and checkStock GPT runs.
+
+    :param product_name (Optional[str]): The product name confirmed by the getProductInfo tool.
+    :param catalog (Optional[Catalog]): The parsed Mock catalog of the chatbot session.
+
+    :return Optional[Tuple[str, str, str]]: A tuple containing the price, the description,
+    and the stock_avail value as strings. Returns None if the product is ambiguous or
+    any of the required fields is missing, so the caller can fall back to the GPT tools.
+    """
+
+    if catalog is None:
+        return None
+
+    product = catalog.find(product_name=product_name)
+    if product is None:
+        return None
+
+    return product.fields()
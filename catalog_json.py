@@ -0,0 +1,185 @@
+"""
+This catalog_json.py code contains the incremental extractor of the Mock
+catalog JSON array from the gpt-4o output. The output is fed in chunks as it
+is streamed, every product object is parsed and validated against the catalog
+schema (product_name, description, price, stock_avail) as soon as it is closed,
+and the extraction stops when the array is complete. Brackets inside the JSON
+strings (e.g. in the descriptions) do not break the extraction.
+"""
+
+import json
+import re
+
+# JSON schema of the structured output requested for the Mock catalog
+CATALOG_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "products": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "product_name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "price": {"type": "string"},
+                    "stock_avail": {"type": "string", "enum": ["True", "False"]}
+                },
+                "required": ["product_name", "description", "price", "stock_avail"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["products"],
+    "additionalProperties": False
+}
+
+# characters removed from the prices before checking they are numbers
+PRICE_PATTERN = re.compile(r'[^0-9.\-]')
+
+
+def validate_product(product=None):
+    """
+    This function validates a product of the Mock catalog and normalizes its values.
+
+    :param product (Optional[dict]): The product dictionary.
+
+    :return dict: The product with a non-empty 'product_name' and 'description', the 'price' as
+    a numeric string and 'stock_avail' as 'True' or 'False'.
+    :raises ValueError: If a field is missing or invalid.
+    """
+
+    if not isinstance(product, dict):
+        raise ValueError(f"The product is not a JSON object: {product}")
+
+    product_name = str(product.get('product_name') or '').strip()
+    description = str(product.get('description') or '').strip()
+    if not product_name or not description:
+        raise ValueError(f"Missing product_name or description: {product}")
+
+    price = PRICE_PATTERN.sub('', str(product.get('price', '')))
+    try:
+        float(price)
+    except ValueError:
+        raise ValueError(f"Invalid price: {product}")
+
+    stock_avail = str(product.get('stock_avail', '')).strip().lower()
+    if stock_avail not in ('true', 'false'):
+        raise ValueError(f"Invalid stock_avail: {product}")
+
+    return {
+        'product_name': product_name,
+        'description': description,
+        'price': price,
+        'stock_avail': 'True' if stock_avail == 'true' else 'False'
+    }
+
+
+class CatalogStreamParser:
+    """
+    This class extracts the products of the first JSON array of objects found in a streamed text.
+    """
+
+    def __init__(self):
+        self.products = []
+        self.invalid = 0
+        self.done = False
+        self._array = False
+        self._depth = 0
+        self._string = False
+        self._escape = False
+        self._object = []
+
+    def _reset_array(self):
+        self._array = False
+        self._depth = 0
+        self._object = []
+
+    def feed(self, chunk=None):
+        """
+        This function feeds a chunk of the streamed text into the parser.
+
+        :param chunk (Optional[str]): The next chunk of the text.
+
+        :return bool: True when the array is complete and the stream can be closed.
+        """
+
+        for char in chunk or '':
+            if self.done:
+                break
+
+            if not self._array:
+                # look for the opening bracket of the array
+                if char == '[':
+                    self._array = True
+                continue
+
+            if self._depth == 0:
+                # between the objects of the array
+                if char == '{':
+                    self._depth = 1
+                    self._object = [char]
+                elif char == ']':
+                    if self.products:
+                        self.done = True
+                    else:
+                        self._reset_array()
+                elif not (char.isspace() or char == ','):
+                    # not an array of objects (e.g. a bracket in the text)
+                    self._reset_array()
+                continue
+
+            # inside an object of the array
+            self._object.append(char)
+            if self._string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._string = False
+            elif char == '"':
+                self._string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._add_object(''.join(self._object))
+                    self._object = []
+
+        return self.done
+
+    def _add_object(self, text):
+        try:
+            self.products.append(validate_product(json.loads(text)))
+        except ValueError as error:
+            # a bad product is dropped instead of the whole catalog
+            self.invalid += 1
+            print(error, 'invalid_mock_product')
+
+    def result(self):
+        """
+        This function returns the extracted Mock catalog.
+
+        :return str: The valid products of the catalog as a JSON array string.
+        :raises ValueError: If no valid product was extracted.
+        """
+
+        if not self.products:
+            raise ValueError("No valid product found in the Mock catalog output")
+        return json.dumps(self.products)
+
+
+def extract_catalog(text=None):
+    """
+    This function extracts the Mock catalog JSON array from a complete gpt-4o output.
+
+    :param text (Optional[str]): The gpt-4o output.
+
+    :return str: The valid products of the catalog as a JSON array string.
+    :raises ValueError: If no valid product was extracted.
+    """
+
+    parser = CatalogStreamParser()
+    parser.feed(text)
+    return parser.result()
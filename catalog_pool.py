@@ -0,0 +1,292 @@
+"""
+This catalog_pool.py code contains the pool of pre-generated Mock catalogs of
+the ShopBot API. A background thread keeps a bounded pool of validated and
+pre-parsed catalogs, refilling it when it falls under a low watermark, so /ini
+takes a ready catalog in O(1) instead of waiting for a gpt-4o completion.
+The pool is persisted to disk so the ready catalogs survive a restart.
+A local stub generator is also available for tests without the OpenAI API.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from catalog import load_catalog
+from catalog_json import CATALOG_SCHEMA, CatalogStreamParser, validate_product
+
+
+def validate_catalog(mock_products=None):
+    """
+    This function validates a Mock catalog JSON string and pre-parses it in the catalog cache.
+
+    :param mock_products (Optional[str]): A JSON string with the Mock catalog.
+
+    :return str: The same JSON string if it is valid.
+    :raises ValueError: If the catalog is not a non-empty list of products following the
+    catalog schema.
+    """
+
+    try:
+        data = json.loads(mock_products)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"Invalid Mock catalog JSON: {error}")
+
+    if not isinstance(data, list) or len(data) == 0:
+        raise ValueError("The Mock catalog must be a non-empty JSON array")
+    for product in data:
+        validate_product(product)
+
+    load_catalog(mock_products=mock_products)
+    return mock_products
+
+
+def openai_catalog_generator(
+        client=None,
+        model="gpt-4o",
+        min_size=2,
+        max_size=15,
+        structured=False):
+    """
+    This function returns a generator of Mock catalogs using a streamed gpt-4o completion.
+    The catalog array is extracted and validated incrementally while the completion is
+    streamed, and the stream is closed as soon as the array is complete.
+
+    :param client (Optional[OpenAI]): The OpenAI client.
+    :param model (str): The GPT model used for the completion.
+    :param min_size (int): The minimum number of products of a catalog.
+    :param max_size (int): The maximum number of products of a catalog.
+    :param structured (bool): True to request a structured JSON output following the catalog
+    schema, so the output is always a valid catalog.
+
+    :return Callable[[], str]: A function returning a new Mock catalog as a JSON string.
+    """
+
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "mock_catalog",
+            "schema": CATALOG_SCHEMA,
+            "strict": True}} if structured else None
+
+    def generate():
+        size = random.randint(min_size, max_size)
+
+        """
+         ** Here you define the mock catalog with a different role **
+        """
+        extra_args = {} if response_format is None else {
+            "response_format": response_format}
+
+        response_mock = client.chat.completions.create(
+            model=model,
+            stream=True,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a helpful AI ShopBot system. You will give me adequate prompts for giving a good serving in a shopping context as mock catalogs"},
+                {
+                    "role": "system",
+                    "content": "Can you give me a random Mock catalog of unique products with size of " +
+                    str(size) +
+                    " as json, with product_name, description, price, and stock_avail (as string between 'True' or 'False') fields? \n"}],
+            **extra_args)
+
+        # parse the json array while the completion is streamed
+        parser = CatalogStreamParser()
+        with response_mock:
+            for chunk in response_mock:
+                if chunk.choices and parser.feed(chunk.choices[0].delta.content):
+                    break
+
+        return parser.result()
+
+    return generate
+
+
+def stub_catalog_generator(seed=None, min_size=2, max_size=15):
+    """
+    This function returns a local generator of random Mock catalogs, used for tests and
+    benchmarks without the OpenAI API.
+
+    :param seed (Optional[int]): The seed of the random generator.
+    :param min_size (int): The minimum number of products of a catalog.
+    :param max_size (int): The maximum number of products of a catalog.
+
+    :return Callable[[], str]: A function returning a new Mock catalog as a JSON string.
+    """
+
+    generator = random.Random(seed)
+    brands = ['EcoBreeze', 'SmartHome', 'AquaPure', 'SoundWave', 'FitPro',
+              'ChefMate', 'GlowLite', 'TrailBlazer', 'ZenLeaf', 'PixelView']
+    items = ['Air Purifier', 'Desk Lamp', 'Water Bottle', 'Wireless Earbuds',
+             'Yoga Mat', 'Coffee Maker', 'Backpack', 'Smart Watch',
+             'Blender', 'Bluetooth Speaker', 'Running Shoes', 'Tea Kettle']
+
+    def generate():
+        size = generator.randint(min_size, max_size)
+        names = generator.sample(
+            [brand + ' ' + item for brand in brands for item in items], size)
+        return json.dumps([
+            {
+                'product_name': name,
+                'description': 'A high quality ' + name.split(' ', 1)[1].lower() + ' by ' + name.split(' ')[0] + '.',
+                'price': '%.2f' % generator.uniform(5, 500),
+                'stock_avail': generator.choice(['True', 'False'])
+            } for name in names])
+
+    return generate
+
+
+class CatalogPool:
+    """
+    This class is a bounded pool of ready Mock catalogs refilled by a background thread.
+    """
+
+    def __init__(
+            self,
+            generator=None,
+            capacity=8,
+            low_watermark=3,
+            path=None,
+            retry_seconds=5.0,
+            max_attempts=3):
+        """
+        :param generator (Callable[[], str]): The function generating a new Mock catalog.
+        :param capacity (int): The maximum number of ready catalogs in the pool.
+        :param low_watermark (int): The pool is refilled when it has fewer catalogs than this.
+        :param path (Optional[str]): The JSON file where the pool is persisted, None to keep
+        it only in memory.
+        :param retry_seconds (float): The waiting time after a failed generation.
+        :param max_attempts (int): The number of generations tried to get a valid catalog.
+        """
+
+        self.generator = generator
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self._catalogs = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file_pool:
+                stored = json.load(file_pool)
+        except (OSError, ValueError):
+            return
+        for mock_products in stored[:self.capacity]:
+            try:
+                self._catalogs.append(validate_catalog(mock_products))
+            except ValueError:
+                continue
+
+    def _persist(self):
+        # must be called holding the condition lock
+        if self.path is None:
+            return
+        path_tmp = self.path + '.tmp'
+        with open(path_tmp, 'w') as file_pool:
+            json.dump(list(self._catalogs), file_pool)
+        os.replace(path_tmp, self.path)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._catalogs)
+
+    def generate(self):
+        """
+        This function generates and validates a new Mock catalog, retrying if the generated
+        catalog is not valid.
+
+        :return str: A valid Mock catalog as a JSON string.
+        :raises ValueError: If no valid catalog is generated after max_attempts.
+        """
+
+        for attempt in range(0, self.max_attempts):
+            try:
+                return validate_catalog(self.generator())
+            except ValueError as error:
+                print(error, 'invalid_mock_catalog')
+        raise ValueError(
+            f"No valid Mock catalog after {self.max_attempts} attempts")
+
+    def start(self):
+        """
+        This function starts the background thread refilling the pool.
+
+        :return CatalogPool: The pool itself.
+        """
+
+        with self._condition:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(
+                    target=self._refill, name='catalog-pool', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        This function stops the background thread refilling the pool.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._dirty and len(
+                        self._catalogs) >= self.low_watermark:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                # the catalogs taken by pop are persisted here, off the request path
+                if self._dirty:
+                    self._persist()
+                    self._dirty = False
+                if len(self._catalogs) >= self.low_watermark:
+                    continue
+            # fill the pool up to its capacity outside the lock
+            while len(self) < self.capacity and not self._stopped:
+                try:
+                    mock_products = self.generate()
+                except Exception as error:
+                    print(error, 'catalog_pool_error')
+                    time.sleep(self.retry_seconds)
+                    continue
+                with self._condition:
+                    self._catalogs.append(mock_products)
+                    self._persist()
+
+    def pop(self):
+        """
+        This function takes a ready Mock catalog from the pool. If the pool is empty the catalog
+        is generated right away.
+
+        :return str: A valid Mock catalog as a JSON string.
+        """
+
+        with self._condition:
+            mock_products = self._catalogs.popleft() if self._catalogs else None
+            if mock_products is not None:
+                self._dirty = True
+            self._condition.notify_all()
+
+        if mock_products is None:
+            mock_products = self.generate()
+        return mock_products
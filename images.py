@@ -0,0 +1,221 @@
+"""
+This images.py code contains the product image service of the ShopBot API.
+The images are kept in a content-addressed cache keyed by the normalized
+product name and fetched by a background worker pool, so /predict returns a
+cached image or a placeholder right away and the chatbot widget swaps the
+image in when it is ready. Only the fetched image is moved into the static
+folder, the image tree is never copied. A product without image is kept as a
+negative entry for a while, so it is not downloaded again on every query.
+"""
+
+import glob
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bing_image_downloader import downloader
+
+# placeholder image shown while the product image is not ready
+PLACEHOLDER_IMAGE = '../static/images/gray.jpg'
+
+
+def normalize_product_name(product_name=None):
+    """
+    This function normalizes a product name for the image cache.
+
+    :param product_name (Optional[str]): The product name.
+
+    :return str: The case-folded product name with single spaces.
+    """
+
+    return ' '.join(str(product_name or '').casefold().split())
+
+
+def image_key(product_name=None):
+    """
+    This function returns the cache key of the image of a product.
+
+    :param product_name (Optional[str]): The product name.
+
+    :return str: The hexadecimal key of the normalized product name.
+    """
+
+    return hashlib.sha1(normalize_product_name(
+        product_name).encode('utf-8')).hexdigest()[:20]
+
+
+def no_fetcher(product_name=None, output_dir=None):
+    """
+    This function is the image fetcher of the offline benchmarks: it never finds an image, so the
+    placeholder image is always shown.
+
+    :param product_name (Optional[str]): The product name used as query.
+    :param output_dir (Optional[str]): The directory where the image would be downloaded.
+
+    :return None: No image is downloaded.
+    """
+
+    return None
+
+
+def bing_fetcher(product_name=None, output_dir=None, timeout=60):
+    """
+    This function downloads the first Bing image of a product.
+
+    :param product_name (Optional[str]): The product name used as query.
+    :param output_dir (Optional[str]): The directory where the image is downloaded.
+    :param timeout (int): The download timeout in seconds.
+
+    :return Optional[str]: The path of the downloaded image, or None if it was not found.
+    """
+
+    query = product_name.replace(' ', '_')
+    downloader.download(
+        query,
+        limit=1,
+        output_dir=output_dir,
+        adult_filter_off=True,
+        force_replace=False,
+        timeout=timeout,
+        verbose=False)
+
+    list_of_files = glob.glob(os.path.join(output_dir, query, '*'))
+    if not list_of_files:
+        return None
+    return max(list_of_files, key=os.path.getctime)
+
+
+class ImageService:
+    """
+    This class fetches the product images in background and keeps them in a content-addressed cache.
+    """
+
+    def __init__(
+            self,
+            cache_dir='./static/img_results/',
+            url_prefix='../static/img_results/',
+            placeholder=PLACEHOLDER_IMAGE,
+            fetcher=bing_fetcher,
+            workers=4,
+            negative_ttl=600.0,
+            clock=time.monotonic):
+        """
+        :param cache_dir (str): The static directory of the cached images.
+        :param url_prefix (str): The URL prefix of the cached images for the chatbot widget.
+        :param placeholder (str): The URL of the image shown while the product image is not ready.
+        :param fetcher (Callable[[str, str], Optional[str]]): The function downloading the image of a
+        product into a directory and returning its path.
+        :param workers (int): The number of background fetching threads.
+        :param negative_ttl (float): The seconds the placeholder is returned for a product whose
+        fetch failed or found no image, before the image is fetched again.
+        :param clock (Callable[[], float]): The monotonic clock.
+        """
+
+        self.cache_dir = cache_dir
+        self.url_prefix = url_prefix
+        self.placeholder = placeholder
+        self.fetcher = fetcher
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='image-service')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._index = {}
+        # cache key -> time until which the product is known to have no image
+        self._missing = {}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(self.cache_dir, '*.*')):
+            self._index[os.path.splitext(os.path.basename(path))[0]] = os.path.basename(path)
+
+    def lookup(self, product_name=None):
+        """
+        This function returns the URL of the cached image of a product.
+
+        :param product_name (Optional[str]): The product name.
+
+        :return Optional[str]: The image URL, or None if the image is not cached yet.
+        """
+
+        return self.lookup_key(key=image_key(product_name))
+
+    def lookup_key(self, key=None):
+        """
+        This function returns the URL of the cached image of a cache key.
+
+        :param key (Optional[str]): The image cache key.
+
+        :return Optional[str]: The image URL, or None if the image is not cached yet.
+        """
+
+        with self._lock:
+            file_name = self._index.get(key)
+        if file_name is None:
+            return None
+        return self.url_prefix + file_name
+
+    def request(self, product_name=None):
+        """
+        This function returns the image of a product right away. If the image is not cached it is
+        fetched in background and the placeholder image is returned.
+
+        :param product_name (Optional[str]): The product name.
+
+        :return Tuple[str, bool]: A tuple containing:
+        - img_path: The URL of the cached image or of the placeholder image.
+        - ready: True if the returned URL is the product image.
+        """
+
+        key = image_key(product_name)
+        url = self.lookup_key(key=key)
+        if url is not None:
+            return url, True
+
+        with self._lock:
+            # the fetch of a product without image is only retried after its negative entry expires
+            missing_until = self._missing.get(key)
+            if missing_until is not None and missing_until <= self.clock():
+                del self._missing[key]
+                missing_until = None
+            if missing_until is None and key not in self._in_flight and key not in self._index:
+                self._in_flight[key] = self._executor.submit(
+                    self._fetch, key, product_name)
+        return self.placeholder, False
+
+    def _mark_missing(self, key):
+        now = self.clock()
+        with self._lock:
+            # the expired entries are dropped so the negative entries stay bounded
+            for expired in [k for k, until in self._missing.items() if until <= now]:
+                del self._missing[expired]
+            self._missing[key] = now + self.negative_ttl
+
+    def _fetch(self, key, product_name):
+        download_dir = os.path.join(self.cache_dir, '.download', key)
+        try:
+            path = self.fetcher(product_name=product_name, output_dir=download_dir)
+            if path is None:
+                self._mark_missing(key)
+            else:
+                file_name = key + os.path.splitext(path)[1].lower()
+                os.replace(path, os.path.join(self.cache_dir, file_name))
+                with self._lock:
+                    self._index[key] = file_name
+        except Exception as error:
+            print(error, 'image_fetch_error')
+            self._mark_missing(key)
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def shutdown(self):
+        """
+        This function stops the background fetching threads.
+        """
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,337 @@
+"""
+This interaction_log.py code contains the batched writer of the ShopBot
+interaction log. The ShopData and ShopData_Product rows of every chat message
+are queued and written in bulk (executemany) by a background thread when the
+batch is full or the flush interval expires, instead of two synchronous
+commits per message. The queue is bounded: when it is full the callers wait
+(backpressure) and finally write their rows themselves, and the pending rows
+are flushed when the process exits. Only the connection errors are retried:
+if a row of a batch violates a constraint, the rows of the batch are written
+one by one and only the invalid rows are dropped. The asyncio version of the writer is used
+by app_async.py.
+"""
+
+import asyncio
+import atexit
+import queue
+import threading
+import time
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, InterfaceError, OperationalError
+
+from models_database import ShopData, ShopData_Product
+
+# marker put in the queue to stop the writer thread
+_STOP = object()
+
+# errors of the rows themselves (constraint violations, invalid values), the
+# same rows fail again if they are retried
+ROW_ERRORS = (IntegrityError, DataError)
+
+
+def is_connection_error(error=None):
+    """
+    This function checks if a database error is a connection error, the only errors retried.
+
+    :param error (Optional[Exception]): The error raised by the write.
+
+    :return bool: True for a lost or refused connection or a timeout.
+    """
+
+    if isinstance(error, (OperationalError, InterfaceError, ConnectionError, TimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def _assign_sqlite_ids(session, model, rows):
+    # SQLite has no identity column for the composite keys of the partitioned
+    # tables (see models_database.py), so the local databases of the benchmarks
+    # take the ids after the largest one
+    next_id = session.execute(select(func.coalesce(func.max(model.id), 0))).scalar() + 1
+    return [dict(row, id=next_id + index) for index, row in enumerate(rows)]
+
+
+class InteractionLogWriter:
+    """
+    This class queues the interaction and product rows and writes them in bulk in background.
+    """
+
+    def __init__(
+            self,
+            app=None,
+            db=None,
+            max_batch=200,
+            flush_interval=1.0,
+            max_queue=10000,
+            put_timeout=5.0,
+            max_retries=3):
+        """
+        :param app (Optional[Flask]): The Flask app, used for the database app context.
+        :param db (Optional[SQLAlchemy]): The SQLAlchemy database object.
+        :param max_batch (int): The number of messages that triggers a flush.
+        :param flush_interval (float): The maximum seconds a queued message waits for a flush.
+        :param max_queue (int): The maximum number of queued messages.
+        :param put_timeout (float): The seconds a caller waits when the queue is full before
+        writing its rows synchronously.
+        :param max_retries (int): The number of attempts to write a batch after a connection
+        error.
+        """
+
+        self.app = app
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        This function starts the background writer thread and registers the flush on exit.
+
+        :return InteractionLogWriter: The writer itself.
+        """
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='interaction-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        return self
+
+    def log(self, interaction=None, product=None):
+        """
+        This function queues the rows of a chat message.
+
+        :param interaction (Optional[dict]): The column values of the ShopData row.
+        :param product (Optional[dict]): The column values of the ShopData_Product row, if
+        the message was a product query.
+        """
+
+        item = (interaction, product)
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            # the writer is behind, so the rows are written by the caller
+            print('interaction log queue full', 'interaction_log')
+            self._write([item])
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = None
+            while len(batch) < self.max_batch:
+                timeout = None if deadline is None else max(
+                    deadline - time.monotonic(), 0)
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        tables = [
+            (ShopData, [interaction for interaction, _ in batch if interaction]),
+            (ShopData_Product, [product for _, product in batch if product])]
+
+        try:
+            self._insert(tables)
+        except ROW_ERRORS as error:
+            # a single invalid row fails the whole batch, so the rows are
+            # written one by one and only the invalid ones are dropped
+            print(error, 'interaction_log_row_error')
+            dropped = 0
+            for model, rows in tables:
+                for row in rows:
+                    try:
+                        self._insert([(model, [row])])
+                    except Exception as error:
+                        print(error, 'interaction_log_row_error')
+                        dropped += 1
+            if dropped:
+                print(dropped, 'interaction_log_dropped')
+        except Exception as error:
+            print(error, 'interaction_log_error')
+            print(len(batch), 'interaction_log_dropped')
+
+    def _insert(self, tables):
+        # insert the rows of every table in one transaction, retrying the connection errors
+        for attempt in range(0, self.max_retries):
+            try:
+                with self.app.app_context():
+                    for model, rows in tables:
+                        if not rows:
+                            continue
+                        if self.db.engine.dialect.name == 'sqlite':
+                            rows = _assign_sqlite_ids(self.db.session, model, rows)
+                        self.db.session.execute(insert(model), rows)
+                    self.db.session.commit()
+                return
+            except Exception as error:
+                with self.app.app_context():
+                    self.db.session.rollback()
+                if not is_connection_error(error) or attempt + 1 >= self.max_retries:
+                    raise
+                print(error, 'interaction_log_error')
+                time.sleep(0.5 * (attempt + 1))
+
+    def close(self):
+        """
+        This function flushes the queued rows and stops the writer thread.
+        """
+
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+        # rows queued after the stop marker
+        pending = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                pending.append(item)
+        if pending:
+            self._write(pending)
+
+
+class AsyncInteractionLogWriter:
+    """
+    This class queues the interaction and product rows and writes them in bulk from an asyncio task,
+    using an async SQLAlchemy engine (e.g. postgresql+asyncpg).
+    """
+
+    def __init__(
+            self,
+            engine=None,
+            max_batch=200,
+            flush_interval=1.0,
+            max_queue=10000,
+            max_retries=3):
+        """
+        :param engine (Optional[AsyncEngine]): The async SQLAlchemy engine of the database.
+        :param max_batch (int): The number of messages that triggers a flush.
+        :param flush_interval (float): The maximum seconds a queued message waits for a flush.
+        :param max_queue (int): The maximum number of queued messages, the callers wait when the
+        queue is full.
+        :param max_retries (int): The number of attempts to write a batch after a connection
+        error.
+        """
+
+        self.engine = engine
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        """
+        This function starts the writer task in the running event loop.
+
+        :return AsyncInteractionLogWriter: The writer itself.
+        """
+
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def log(self, interaction=None, product=None):
+        """
+        This function queues the rows of a chat message, waiting while the queue is full.
+
+        :param interaction (Optional[dict]): The column values of the ShopData row.
+        :param product (Optional[dict]): The column values of the ShopData_Product row, if
+        the message was a product query.
+        """
+
+        await self._queue.put((interaction, product))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = None
+            while len(batch) < self.max_batch:
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = loop.time() + self.flush_interval
+            if batch:
+                await self._write(batch)
+
+    async def _write(self, batch):
+        tables = [
+            (ShopData, [interaction for interaction, _ in batch if interaction]),
+            (ShopData_Product, [product for _, product in batch if product])]
+
+        try:
+            await self._insert(tables)
+        except ROW_ERRORS as error:
+            # only the invalid rows are dropped (see InteractionLogWriter._write)
+            print(error, 'interaction_log_row_error')
+            dropped = 0
+            for model, rows in tables:
+                for row in rows:
+                    try:
+                        await self._insert([(model, [row])])
+                    except Exception as error:
+                        print(error, 'interaction_log_row_error')
+                        dropped += 1
+            if dropped:
+                print(dropped, 'interaction_log_dropped')
+        except Exception as error:
+            print(error, 'interaction_log_error')
+            print(len(batch), 'interaction_log_dropped')
+
+    async def _insert(self, tables):
+        # insert the rows of every table in one transaction, retrying the connection errors
+        for attempt in range(0, self.max_retries):
+            try:
+                async with self.engine.begin() as connection:
+                    for model, rows in tables:
+                        if rows:
+                            await connection.execute(insert(model.__table__), rows)
+                return
+            except Exception as error:
+                if not is_connection_error(error) or attempt + 1 >= self.max_retries:
+                    raise
+                print(error, 'interaction_log_error')
+                await asyncio.sleep(0.5 * (attempt + 1))
+
+    async def close(self):
+        """
+        This function flushes the queued rows and stops the writer task.
+        """
+
+        task, self._task = self._task, None
+        if task is None:
+            return
+        await self._queue.put(_STOP)
+        await task
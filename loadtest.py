@@ -0,0 +1,286 @@
+"""
+This loadtest.py code contains the end-to-end load test of the ShopBot API
+(app.py) without network access. It starts the local mock of the OpenAI API
+(mock_openai.py), points the API to it and to a local SQLite database, and
+drives /adduser, /ini and /predict with N concurrent simulated users through
+the Flask test client. It reports the throughput and the p50/p95/p99 latency
+of every endpoint, of every phase of the /predict pipeline and of every phase
+of the GPT runs (see runs.run_timer), and the tokens and cost of every model
+call.
+
+Run it with: python loadtest.py --users 20 --messages 6 --latency run=lognormal:0.8:0.3
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from metrics import PhaseTimer
+from mock_openai import parse_latencies, serve
+
+# outcomes of the endpoints and of the run phases that are not errors
+SUCCESS_OUTCOMES = ('ok', 'completed', 'requires_action')
+
+# conversational turns mixed with the product queries of every simulated user
+SMALL_TALK = ['Hello!', 'Hi there', 'What products do you have?', 'Can you help me?']
+
+
+def configure_environment(base_url=None, work_dir=None, database_uri=None, catalog_generator='openai'):
+    """
+    This function points the ShopBot API to the mock OpenAI API and to local files. The variables
+    already set in the environment are kept.
+
+    :param base_url (Optional[str]): The base URL of the mock OpenAI API.
+    :param work_dir (Optional[str]): The directory of the database and of the local state files.
+    :param database_uri (Optional[str]): The database URI, a SQLite file in work_dir by default.
+    :param catalog_generator (str): 'openai' to generate the catalogs with the mock API, or 'stub'.
+    """
+
+    os.environ['SHOPBOT_OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('openAI_key', 'mock')
+    os.environ.setdefault(
+        'SHOPBOT_DATABASE_URI', database_uri or 'sqlite:///' + os.path.join(work_dir, 'loadtest.db'))
+    os.environ.setdefault('SHOPBOT_CATALOG_GENERATOR', catalog_generator)
+    os.environ.setdefault('SHOPBOT_CATALOG_POOL_PATH', os.path.join(work_dir, 'catalog_pool.json'))
+    os.environ.setdefault('SHOPBOT_ASSISTANT_IDS', os.path.join(work_dir, 'assistant_ids.json'))
+    os.environ.setdefault('SHOPBOT_SESSION_STORE', 'memory://')
+    os.environ.setdefault('SHOPBOT_IMAGE_FETCHER', 'none')
+
+
+def user_messages(product_names=None, count=5, rng=None):
+    """
+    This function returns the messages of a simulated user: product queries and small talk,
+    ending with a goodbye.
+
+    :param product_names (Optional[List[str]]): The product names of the catalog of the session.
+    :param count (int): The number of messages.
+    :param rng (Optional[random.Random]): The random generator.
+
+    :return List[str]: The messages.
+    """
+
+    if count <= 0:
+        return []
+
+    messages = []
+    for index in range(0, count - 1):
+        choice = rng.random()
+        if product_names and choice < 0.5:
+            messages.append('Tell me about the ' + rng.choice(product_names))
+        elif product_names and choice < 0.7:
+            # a partial name, which the local matcher may not resolve
+            messages.append('Do you have any ' + rng.choice(product_names).split(' ')[-1].lower() + '?')
+        else:
+            messages.append(rng.choice(SMALL_TALK))
+    messages.append('Thank you, bye!')
+    return messages
+
+
+def timed_post(client=None, timer=None, endpoint=None, payload=None):
+    """
+    This function posts a JSON payload to an endpoint of the API and records its latency.
+
+    :param client (Optional[FlaskClient]): The Flask test client.
+    :param timer (Optional[PhaseTimer]): The timer of the endpoints.
+    :param endpoint (Optional[str]): The endpoint path.
+    :param payload (Optional[dict]): The JSON payload.
+
+    :return Optional: The JSON response, or None if the request failed.
+    """
+
+    start = time.monotonic()
+    try:
+        response = client.post(endpoint, json=payload)
+    except Exception as error:
+        timer.record(phase=endpoint, seconds=time.monotonic() - start, outcome='error')
+        print(error, 'loadtest_request_error')
+        return None
+    timer.record(
+        phase=endpoint, seconds=time.monotonic() - start,
+        outcome='ok' if response.status_code == 200 else str(response.status_code))
+    return response.get_json() if response.status_code == 200 else None
+
+
+def run_user(shopbot=None, user_index=0, messages=5, timer=None, seed=None):
+    """
+    This function runs the session of a simulated user: login, chat initialization and messages.
+
+    :param shopbot (Optional[module]): The app module of the ShopBot API.
+    :param user_index (int): The index of the user.
+    :param messages (int): The number of messages of the session.
+    :param timer (Optional[PhaseTimer]): The timer of the endpoints.
+    :param seed (Optional[int]): The seed of the random generator.
+    """
+
+    rng = random.Random(None if seed is None else seed + user_index)
+    client = shopbot.app.test_client()
+    username = f'loadtest{user_index}'
+
+    timed_post(client, timer, '/adduser', {'user': username, 'pass': 'loadtest'})
+    ini = timed_post(client, timer, '/ini', {'user': username})
+    if not ini:
+        return
+
+    session = shopbot.session_store.get(session_id=ini['session_id'])
+    product_names = list(shopbot.load_catalog(mock_products=session.mock_products).names)
+
+    for message in user_messages(product_names=product_names, count=messages, rng=rng):
+        timed_post(client, timer, '/predict', {'message': message, 'session_id': ini['session_id']})
+
+
+def check_semantic_cache(shopbot=None, timer=None, message='Hello!'):
+    """
+    This function checks that the semantic cache is shared by the sessions: the same greeting
+    is sent as the first message of two new sessions, with different Mock catalogs, and the
+    second one must be answered from the cache with the product list of its own catalog.
+
+    :param shopbot (Optional[module]): The app module of the ShopBot API.
+    :param timer (Optional[PhaseTimer]): The timer of the endpoints.
+    :param message (str): The greeting sent by both sessions.
+
+    :return bool: True if the second session got a cache hit.
+    """
+
+    client = shopbot.app.test_client()
+    answers = []
+    hits = shopbot.semantic_cache.hits
+    for index in range(0, 2):
+        ini = timed_post(client, timer, '/ini', {'user': f'cachecheck{index}'})
+        if not ini:
+            return False
+        answer = timed_post(
+            client, timer, '/predict', {'message': message, 'session_id': ini['session_id']})
+        session = shopbot.session_store.get(session_id=ini['session_id'])
+        catalog = shopbot.load_catalog(mock_products=session.mock_products)
+        answers.append((answer, catalog))
+
+    (first, _), (second, catalog) = answers
+    return (shopbot.semantic_cache.hits > hits and first is not None and second is not None
+            and second['answer'].endswith(catalog.product_list_html))
+
+
+def format_table(summary=None):
+    """
+    This function formats the statistics of a PhaseTimer as a text table.
+
+    :param summary (Optional[dict]): The summary of a PhaseTimer.
+
+    :return str: The table, one line per phase.
+    """
+
+    lines = ['%-40s %7s %7s %9s %9s %9s %9s' % ('phase', 'count', 'errors', 'p50', 'p95', 'p99', 'max')]
+    for phase, stats in sorted(summary.items()):
+        errors = sum(count for outcome, count in stats['outcomes'].items()
+                     if outcome not in SUCCESS_OUTCOMES)
+        lines.append('%-40s %7d %7d %9.3f %9.3f %9.3f %9.3f' % (
+            phase, stats['count'], errors, stats['p50_seconds'], stats['p95_seconds'],
+            stats['p99_seconds'], stats['max_seconds']))
+    return '\n'.join(lines)
+
+
+def format_usage_table(usage=None):
+    """
+    This function formats the tokens and cost of every model call as a text table.
+
+    :param usage (Optional[dict]): The usage of the model calls of a TokenMeter.
+
+    :return str: The table, one line per model call.
+    """
+
+    lines = ['%-40s %7s %13s %13s %11s' % ('call', 'count', 'prompt', 'completion', 'cost_usd')]
+    for call, stats in sorted(usage.items()):
+        lines.append('%-40s %7d %13d %13d %11.6f' % (
+            call, stats['calls'], stats['prompt_tokens'], stats['completion_tokens'],
+            stats['cost_usd']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test of the ShopBot API.')
+    parser.add_argument('--users', type=int, default=10, help='number of concurrent users')
+    parser.add_argument('--messages', type=int, default=5, help='messages sent by every user')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency', action='append', default=[],
+                        help="latency of the mock OpenAI calls, e.g. run=lognormal:1.0:0.4 "
+                             "(kinds: request, completion, run)")
+    parser.add_argument('--database-uri', default=None,
+                        help='database of the API, a temporary SQLite file by default')
+    parser.add_argument('--catalog-generator', default='openai', choices=['openai', 'stub'])
+    parser.add_argument('--json', default=None, help='file where the report is written as JSON')
+    parser.add_argument('--check-semantic-cache', action='store_true',
+                        help='check that a second session gets a semantic cache hit first')
+    args = parser.parse_args()
+
+    server, base_url = serve(port=0, latencies=parse_latencies(args.latency, seed=args.seed),
+                             seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix='shopbot-loadtest-')
+    configure_environment(
+        base_url=base_url, work_dir=work_dir, database_uri=args.database_uri,
+        catalog_generator=args.catalog_generator)
+
+    # the API is imported after its environment is set
+    import app as shopbot
+    from runs import run_timer
+
+    timer = PhaseTimer(max_samples=100000)
+
+    semantic_check = None
+    if args.check_semantic_cache:
+        semantic_check = check_semantic_cache(shopbot=shopbot, timer=timer)
+        print('semantic cache shared by the sessions:', 'ok' if semantic_check else 'FAILED')
+    users = [threading.Thread(
+        target=run_user, name=f'user-{index}',
+        kwargs={'shopbot': shopbot, 'user_index': index, 'messages': args.messages,
+                'timer': timer, 'seed': args.seed})
+        for index in range(0, args.users)]
+
+    start = time.monotonic()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - start
+
+    endpoints = timer.summary()
+    requests = sum(stats['count'] for stats in endpoints.values())
+    report = {
+        'users': args.users,
+        'messages': args.messages,
+        'latencies': {kind: latency.spec for kind, latency in parse_latencies(args.latency).items()},
+        'elapsed_seconds': elapsed,
+        'requests_per_second': requests / elapsed if elapsed else 0.0,
+        'endpoints': endpoints,
+        'pipeline': shopbot.pipeline_timer.summary(),
+        'phases': run_timer.summary(),
+        'semantic_cache': dict(shopbot.semantic_cache.stats(), shared=semantic_check),
+        'tokens': {name: usage for name, usage in shopbot.token_meter.usage().items()
+                   if name in ('endpoints', 'calls')}}
+
+    print('%d users, %d requests in %.2f s (%.1f requests/s)' % (
+        args.users, requests, elapsed, report['requests_per_second']))
+    print()
+    print(format_table(endpoints))
+    print()
+    print(format_table(report['pipeline']))
+    print()
+    print(format_table(report['phases']))
+    print()
+    print(format_usage_table(report['tokens']['calls']))
+
+    if args.json:
+        with open(args.json, 'w') as file_report:
+            json.dump(report, file_report, indent=2)
+
+    shopbot.catalog_pool.stop()
+    server.shutdown()
+
+    if semantic_check is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+This matcher.py code contains the local fuzzy product_name matcher of the
+ShopBot API. It resolves the product mentioned in the user message against
+the product names of the Mock catalog using character trigram similarity
+between tokens and an IDF weighted token-set coverage score per product.
+The scoring is vectorized with NumPy over a precomputed index, and only
+confident matches are returned, so the ambiguous messages are still sent
+to the getProductInfo GPT run.
+"""
+
+import numpy as np
+
+from catalog import tokenize
+
+
+def char_ngrams(token=None, size=3):
+    """
+    This function returns the set of padded character n-grams of a token.
+
+    :param token (Optional[str]): The token to split.
+    :param size (int): The n-gram size.
+
+    :return Set[str]: The set of character n-grams.
+    """
+
+    padded = ' ' + str(token or '') + ' '
+    if len(padded) <= size:
+        return {padded}
+    return {padded[index:index + size]
+            for index in range(0, len(padded) - size + 1)}
+
+
+class ProductMatcher:
+    """
+    This class is the local fuzzy matcher over the product names of a Mock catalog.
+    """
+
+    def __init__(
+            self,
+            product_names=None,
+            token_threshold=0.6,
+            min_score=0.6,
+            margin=0.15):
+        """
+        :param product_names (Optional[List[str]]): The product names of the catalog.
+        :param token_threshold (float): The minimum trigram cosine similarity for a token of
+        the message to count as a (misspelled) token of a product name.
+        :param min_score (float): The minimum IDF weighted fraction of a product name that must be
+        covered by the message for the match to be confident.
+        :param margin (float): The minimum score difference against the second best product when
+        more than one product is covered by the message.
+        """
+
+        self.product_names = list(product_names or [])
+        self.token_threshold = token_threshold
+        self.min_score = min_score
+        self.margin = margin
+
+        name_tokens = [sorted(set(tokenize(name))) for name in self.product_names]
+        self.vocabulary = sorted({token for tokens in name_tokens for token in tokens})
+        vocabulary_index = {token: index for index, token in enumerate(self.vocabulary)}
+
+        # trigram -> vocabulary tokens posting lists and trigram count per token
+        postings = {}
+        self.token_gram_counts = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for index, token in enumerate(self.vocabulary):
+            grams = char_ngrams(token)
+            self.token_gram_counts[index] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(index)
+        self.gram_postings = {gram: np.asarray(indexes, dtype=np.int32)
+                              for gram, indexes in postings.items()}
+
+        # (product, token) entries of the names weighted with the token IDF
+        self.entry_names = np.asarray(
+            [row for row, tokens in enumerate(name_tokens) for _ in tokens],
+            dtype=np.int32)
+        self.entry_tokens = np.asarray(
+            [vocabulary_index[token] for tokens in name_tokens for token in tokens],
+            dtype=np.int32)
+        document_frequency = np.bincount(
+            self.entry_tokens, minlength=len(self.vocabulary))
+        idf = np.log1p(len(self.product_names) /
+                       np.maximum(document_frequency, 1)).astype(np.float32)
+        self.entry_weights = idf[self.entry_tokens]
+        self.name_weights = np.maximum(np.bincount(
+            self.entry_names, weights=self.entry_weights,
+            minlength=len(self.product_names)), 1e-9)
+
+    def scores(self, text=None):
+        """
+        This function scores every product name of the catalog against a user message.
+
+        :param text (Optional[str]): The user message.
+
+        :return Tuple[np.ndarray, np.ndarray]: A tuple containing:
+        - coverage: The IDF weighted fraction of each product name covered by the message.
+        - matched: The absolute IDF weight of each product name covered by the message.
+        """
+
+        matched = np.zeros(len(self.product_names), dtype=np.float64)
+        query_tokens = sorted(set(tokenize(text)))
+        if not query_tokens or not self.vocabulary:
+            return matched, matched
+
+        # best trigram cosine similarity of each vocabulary token against the
+        # message tokens
+        similarity = np.zeros(len(self.vocabulary), dtype=np.float64)
+        for token in query_tokens:
+            grams = char_ngrams(token)
+            hits = [self.gram_postings[gram] for gram in grams
+                    if gram in self.gram_postings]
+            if not hits:
+                continue
+            shared = np.bincount(np.concatenate(hits),
+                                 minlength=len(self.vocabulary))
+            np.maximum(similarity, shared / np.sqrt(
+                self.token_gram_counts * len(grams)), out=similarity)
+        similarity[similarity < self.token_threshold] = 0.0
+
+        matched = np.bincount(
+            self.entry_names,
+            weights=self.entry_weights * similarity[self.entry_tokens],
+            minlength=len(self.product_names))
+        coverage = matched / self.name_weights
+        return coverage, matched
+
+    def match(self, text=None):
+        """
+        This function returns the product name mentioned in a user message if the match is
+        confident. A product is confident when most of its name is covered by the message and
+        no other covered product is as specific as it.
+
+        :param text (Optional[str]): The user message.
+
+        :return Optional[str]: The matched product name, or None to escalate the message to
+        the getProductInfo GPT run.
+        """
+
+        if not self.product_names:
+            return None
+
+        coverage, matched = self.scores(text=text)
+        candidates = np.flatnonzero(coverage >= self.min_score)
+        if len(candidates) == 0:
+            return None
+        if len(candidates) == 1:
+            return self.product_names[int(candidates[0])]
+
+        # several names are covered, so keep the most specific one if it is clear
+        ranked = candidates[np.argsort(-matched[candidates], kind='stable')]
+        best, second = int(ranked[0]), int(ranked[1])
+        if (matched[best] - matched[second]) / self.name_weights[best] < self.margin:
+            return None
+        return self.product_names[best]
@@ -0,0 +1,482 @@
+"""
+This metrics.py code contains the metrics collected by the ShopBot API.
+The TokenMeter keeps the prompt and completion tokens and the cost of the
+GPT assistant runs and completions of every turn of each chatbot thread, so
+the per-turn input size can be followed as the conversation grows, and
+aggregates them per session, user, endpoint and model call. The PhaseTimer keeps
+the count and the latency of every phase of the GPT runs (polling, tool output
+submission, streaming), including the runs cancelled after a timeout, with
+the percentiles of the latest latencies and a cumulative histogram exported
+in the Prometheus text format. The TraceLog writes the phases of every request
+as a JSON line, when it is enabled.
+"""
+
+import contextvars
+import json
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# prompt and completion prices of the GPT models in USD per million tokens
+DEFAULT_TOKEN_PRICES = {'gpt-4o': (2.50, 10.00), 'gpt-4o-mini': (0.15, 0.60)}
+
+# trace of the request being served, in the current thread or asyncio task
+_current_trace = contextvars.ContextVar('shopbot_trace', default=None)
+
+
+def percentile(values=None, fraction=0.5):
+    """
+    This function returns a percentile of a list of values (nearest rank).
+
+    :param values (Optional[Iterable[float]]): The values.
+    :param fraction (float): The percentile as a fraction, e.g. 0.95.
+
+    :return Optional[float]: The percentile, or None if there is no value.
+    """
+
+    ordered = sorted(values or [])
+    if not ordered:
+        return None
+    rank = min(max(math.ceil(fraction * len(ordered)), 1), len(ordered))
+    return ordered[rank - 1]
+
+
+def parse_token_prices(spec=None):
+    """
+    This function parses the prices of the GPT models, in USD per million tokens.
+
+    :param spec (Optional[str]): A JSON object from the model name to its [prompt, completion]
+    prices, e.g. '{"gpt-4o": [2.5, 10.0]}', merged with the default prices.
+
+    :return dict: A map from the model name to its (prompt, completion) prices.
+    :raises ValueError: If the prices are not a JSON object of pairs of numbers.
+    """
+
+    prices = dict(DEFAULT_TOKEN_PRICES)
+    if not spec:
+        return prices
+    try:
+        prices.update({model: (float(prompt), float(completion))
+                       for model, (prompt, completion) in json.loads(spec).items()})
+    except (AttributeError, TypeError, ValueError) as error:
+        raise ValueError(f"Invalid token prices {spec!r}: {error}")
+    return prices
+
+
+def _empty_usage():
+    return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0}
+
+
+def _add_usage(total=None, usage=None):
+    for key in ('calls', 'prompt_tokens', 'completion_tokens', 'cost_usd'):
+        total[key] += usage[key]
+
+
+class TokenMeter:
+    """
+    This class accumulates the prompt and completion tokens and the cost of the GPT runs and
+    completions of each turn of a thread. The closed turns are aggregated per session, user,
+    endpoint and model call.
+    """
+
+    def __init__(self, max_turns=200, prices=None, max_keys=10000):
+        """
+        :param max_turns (int): The maximum number of closed turns kept per thread.
+        :param prices (Optional[dict]): A map from the model name to its (prompt, completion)
+        prices in USD per million tokens, see parse_token_prices.
+        :param max_keys (int): The maximum number of threads, sessions and users kept, the least
+        recently used one is dropped when it is exceeded.
+        """
+
+        self.max_turns = max_turns
+        self.prices = dict(DEFAULT_TOKEN_PRICES if prices is None else prices)
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._current = {}
+        self._turns = OrderedDict()
+        self._sessions = OrderedDict()
+        self._users = OrderedDict()
+        self._endpoints = {}
+        self._calls = {}
+
+    def cost(self, model=None, prompt_tokens=0, completion_tokens=0):
+        """
+        This function returns the cost of the tokens of a model call. The dated model versions
+        (e.g. 'gpt-4o-2024-08-06') take the price of the longest model name they start with.
+
+        :param model (Optional[str]): The model of the call.
+        :param prompt_tokens (int): The prompt (input) tokens.
+        :param completion_tokens (int): The completion (output) tokens.
+
+        :return float: The cost in USD, 0 for a model without price.
+        """
+
+        names = [name for name in self.prices if str(model or '').startswith(name)]
+        if not names:
+            return 0.0
+        prompt_price, completion_price = self.prices[max(names, key=len)]
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+    def add_run(self, thread_id=None, run=None, call=None):
+        """
+        This function adds the tokens of a completed GPT run or chat completion to the current
+        turn of a thread. Runs without usage information (not completed yet) are ignored.
+
+        :param thread_id (Optional[str]): The ID of the Assistant thread.
+        :param run (Optional): The GPT assistant run or chat completion object.
+        :param call (Optional[str]): The name of the model call, e.g. 'getProductInfo'.
+        """
+
+        usage = getattr(run, 'usage', None)
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        cost = self.cost(model=getattr(run, 'model', None), prompt_tokens=prompt_tokens,
+                         completion_tokens=completion_tokens)
+        with self._lock:
+            turn = self._current.setdefault(thread_id, {})
+            _add_usage(turn.setdefault(call or 'unknown', _empty_usage()), {
+                'calls': 1, 'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens, 'cost_usd': cost})
+
+    def _aggregate(self, table=None, key=None, usage=None, bounded=False):
+        total = table.get(key)
+        if total is None:
+            total = table[key] = _empty_usage()
+        _add_usage(total, usage)
+        if bounded:
+            table.move_to_end(key)
+            while len(table) > self.max_keys:
+                table.popitem(last=False)
+
+    def end_turn(self, thread_id=None, session_id=None, username=None, endpoint=None):
+        """
+        This function closes the current turn of a thread and adds its tokens to the aggregates
+        of the session, the user, the endpoint and every model call.
+
+        :param thread_id (Optional[str]): The ID of the Assistant thread.
+        :param session_id (Optional[str]): The ID of the chatbot session.
+        :param username (Optional[str]): The username of the chatbot session.
+        :param endpoint (Optional[str]): The endpoint of the turn, e.g. '/predict'.
+
+        :return dict: The calls, prompt and completion tokens and cost in USD of the turn.
+        """
+
+        with self._lock:
+            calls = self._current.pop(thread_id, {})
+            usage = _empty_usage()
+            for call, call_usage in calls.items():
+                _add_usage(usage, call_usage)
+                self._aggregate(self._calls, call, call_usage)
+
+            turns = self._turns.setdefault(thread_id, [])
+            turns.append(usage['prompt_tokens'])
+            del turns[:-self.max_turns]
+            self._turns.move_to_end(thread_id)
+            while len(self._turns) > self.max_keys:
+                self._turns.popitem(last=False)
+
+            if session_id is not None:
+                self._aggregate(self._sessions, session_id, usage, bounded=True)
+            if username is not None:
+                self._aggregate(self._users, username, usage, bounded=True)
+            self._aggregate(self._endpoints, endpoint or 'unknown', usage)
+        return usage
+
+    def summary(self):
+        """
+        This function returns the per-turn prompt tokens of every thread.
+
+        :return dict: A map from the thread ID to the list of prompt tokens per turn.
+        """
+
+        with self._lock:
+            return {thread_id: list(turns)
+                    for thread_id, turns in self._turns.items()}
+
+    def usage(self):
+        """
+        This function returns the aggregated tokens and cost of the closed turns.
+
+        :return dict: The calls, prompt and completion tokens and cost in USD per session, user,
+        endpoint and model call.
+        """
+
+        with self._lock:
+            return {name: {key: dict(usage) for key, usage in table.items()}
+                    for name, table in (('sessions', self._sessions), ('users', self._users),
+                                        ('endpoints', self._endpoints), ('calls', self._calls))}
+
+    def prometheus(self, name='shopbot_tokens'):
+        """
+        This function exports the tokens and the cost per endpoint and model call in the
+        Prometheus text format. The sessions and users are only in usage, to keep the number
+        of series bounded.
+
+        :param name (str): The prefix of the metric names.
+
+        :return str: The metric families of the token and cost counters.
+        """
+
+        lines = [f'# HELP {name}_total Tokens of the GPT runs and completions.',
+                 f'# TYPE {name}_total counter']
+        costs = [f'# HELP {name}_cost_usd_total Cost in USD of the GPT runs and completions.',
+                 f'# TYPE {name}_cost_usd_total counter']
+        with self._lock:
+            for label, table in (('endpoint', self._endpoints), ('call', self._calls)):
+                for key in sorted(table):
+                    usage = table[key]
+                    value = _label_value(key)
+                    for kind in ('prompt', 'completion'):
+                        lines.append(f'{name}_total{{{label}="{value}",kind="{kind}"}} '
+                                     f'{usage[kind + "_tokens"]}')
+                    costs.append(f'{name}_cost_usd_total{{{label}="{value}"}} {usage["cost_usd"]}')
+        return '\n'.join(lines + costs) + '\n'
+
+
+class PhaseTimer:
+    """
+    This class accumulates the number of calls, the total and the maximum latency of named phases,
+    keeps their latest latencies for the percentiles and counts them in histogram buckets. Every
+    phase is also added to the trace of the current request.
+    """
+
+    def __init__(self, clock=time.monotonic, max_samples=2048, buckets=DEFAULT_BUCKETS):
+        """
+        :param clock (Callable[[], float]): The monotonic clock used to time the phases.
+        :param max_samples (int): The number of latest latencies kept per phase.
+        :param buckets (Tuple[float]): The sorted upper bounds of the histogram buckets in seconds.
+        """
+
+        self.clock = clock
+        self.max_samples = max_samples
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._samples = {}
+        self._histograms = {}
+
+    def record(self, phase=None, seconds=0.0, outcome='ok'):
+        """
+        This function adds the latency of a finished phase.
+
+        :param phase (Optional[str]): The phase name.
+        :param seconds (float): The latency of the phase in seconds.
+        :param outcome (str): The outcome of the phase, e.g. 'ok', 'timeout' or 'error'.
+        """
+
+        with self._lock:
+            stats = self._phases.setdefault(
+                phase, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'outcomes': {}})
+            stats['count'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['outcomes'][outcome] = stats['outcomes'].get(outcome, 0) + 1
+            self._samples.setdefault(phase, deque(maxlen=self.max_samples)).append(seconds)
+            histogram = self._histograms.setdefault(phase, [0] * len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[index] += 1
+                    break
+
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(phase=phase, seconds=seconds, outcome=outcome)
+
+    @contextmanager
+    def time(self, phase=None):
+        """
+        This function times the block of a with statement as a phase. The phase outcome is
+        'error' if the block raises an exception.
+
+        :param phase (Optional[str]): The phase name.
+        """
+
+        start = self.clock()
+        outcome = 'ok'
+        try:
+            yield
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            self.record(phase=phase, seconds=self.clock() - start, outcome=outcome)
+
+    def summary(self):
+        """
+        This function returns the statistics of every phase.
+
+        :return dict: A map from the phase name to its count, total, mean and maximum latency in
+        seconds, the p50, p95 and p99 of its latest latencies and the count of every outcome.
+        """
+
+        with self._lock:
+            return {phase: dict(
+                stats,
+                outcomes=dict(stats['outcomes']),
+                mean_seconds=stats['total_seconds'] / stats['count'],
+                p50_seconds=percentile(self._samples[phase], 0.50),
+                p95_seconds=percentile(self._samples[phase], 0.95),
+                p99_seconds=percentile(self._samples[phase], 0.99))
+                for phase, stats in self._phases.items()}
+
+    def prometheus(self, name=None, description=None, label='phase'):
+        """
+        This function exports the latency histogram and the outcomes of every phase in the
+        Prometheus text format.
+
+        :param name (Optional[str]): The metric name, e.g. 'shopbot_run_phase_seconds'.
+        :param description (Optional[str]): The help text of the metric.
+        :param label (str): The label name of the phases.
+
+        :return str: The metric families of the histogram and of the outcome counter.
+        """
+
+        lines = [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+        outcomes = [f'# HELP {name}_outcomes_total Count of every outcome of the {label}s.',
+                    f'# TYPE {name}_outcomes_total counter']
+        with self._lock:
+            for phase in sorted(self._phases):
+                stats = self._phases[phase]
+                value = _label_value(phase)
+                cumulative = 0
+                for bound, count in zip(self.buckets, self._histograms[phase]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {stats["total_seconds"]}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {stats["count"]}')
+                for outcome, count in sorted(stats['outcomes'].items()):
+                    outcomes.append(
+                        f'{name}_outcomes_total{{{label}="{value}",outcome="{_label_value(outcome)}"}} {count}')
+        return '\n'.join(lines + outcomes) + '\n'
+
+
+def _label_value(value=None):
+    # escaping of the Prometheus label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestTrace:
+    """
+    This class keeps the phases of a request, in the order they finished.
+    """
+
+    def __init__(self, endpoint=None, clock=time.monotonic):
+        """
+        :param endpoint (Optional[str]): The endpoint of the request.
+        :param clock (Callable[[], float]): The monotonic clock used to time the phases.
+        """
+
+        self.endpoint = endpoint
+        self.clock = clock
+        self.start = clock()
+        self.started_at = time.time()
+        self.attributes = {}
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def add(self, phase=None, seconds=0.0, outcome='ok'):
+        """
+        This function adds a finished phase to the trace.
+
+        :param phase (Optional[str]): The phase name.
+        :param seconds (float): The latency of the phase in seconds.
+        :param outcome (str): The outcome of the phase.
+        """
+
+        end = self.clock() - self.start
+        with self._lock:
+            self.phases.append({
+                'phase': phase, 'start': round(max(end - seconds, 0.0), 6),
+                'seconds': round(seconds, 6), 'outcome': outcome})
+
+    def to_dict(self, outcome='ok'):
+        """
+        This function returns the trace as a dictionary.
+
+        :param outcome (str): The outcome of the request.
+
+        :return dict: The endpoint, start time, latency, outcome, attributes and phases.
+        """
+
+        with self._lock:
+            phases = list(self.phases)
+        return dict(
+            self.attributes, endpoint=self.endpoint, started_at=self.started_at,
+            seconds=round(self.clock() - self.start, 6), outcome=outcome, phases=phases)
+
+
+class TraceLog:
+    """
+    This class writes the trace of every request as a JSON line in a file. The trace of the
+    current request collects the phases recorded by every PhaseTimer while it is served.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path (Optional[str]): The JSON lines file of the traces, None to disable them.
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def start(self, endpoint=None):
+        """
+        This function starts the trace of a request in the current context.
+
+        :param endpoint (Optional[str]): The endpoint of the request.
+
+        :return Optional[Tuple[RequestTrace, Token]]: The trace and the context token to finish
+        it, or None if the trace log is disabled.
+        """
+
+        if not self.enabled:
+            return None
+        trace = RequestTrace(endpoint=endpoint)
+        return trace, _current_trace.set(trace)
+
+    def finish(self, started=None, outcome='ok'):
+        """
+        This function writes the trace of a request and removes it from the current context.
+
+        :param started (Optional[Tuple[RequestTrace, Token]]): The value returned by start.
+        :param outcome (str): The outcome of the request.
+        """
+
+        if started is None:
+            return
+        trace, token = started
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # finished in another context than it was started
+            _current_trace.set(None)
+        line = json.dumps(trace.to_dict(outcome=outcome), default=str)
+        try:
+            with self._lock, open(self.path, 'a') as file_trace:
+                file_trace.write(line + '\n')
+        except OSError as error:
+            print(error, 'trace_log_error')
+
+
+def annotate_trace(**attributes):
+    """
+    This function adds attributes (e.g. the session ID) to the trace of the current request.
+
+    :param attributes: The attributes of the trace.
+    """
+
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
@@ -0,0 +1,279 @@
+"""
+This migrations.py code contains the schema migrations of the ShopBot
+database. Every migration has a version number, and the versions already
+applied are kept in the shopbot_schema_version table, so the migrations run
+only once at startup after db.create_all(). The migrations are written for
+postgresql, other databases are created directly with the latest schema.
+
+- Version 1: database-generated identity IDs for ShopData and ShopData_Product,
+  replacing the random IDs checked against ids.txt and ids_products.txt.
+- Version 2: typed columns (timestamptz dates, numeric prices, boolean stock),
+  the foreign key between both tables through code, and the composite indexes
+  on (username, date) and (product_name, date), with the backfill of the string
+  values stored before.
+- Version 3: monthly range partitioning by date of both tables (see
+  partitions.py). The existing tables are renamed to *_legacy and their rows
+  are copied into the partitioned tables.
+- Version 4: session ID, prompt and completion tokens and token cost of every
+  interaction row, with the index on (session_id, date) of the per-session
+  accounting queries. The rows stored before have NULL values.
+"""
+
+import datetime
+
+from sqlalchemy import text
+
+from models_database import ShopData, ShopData_Product
+from partitions import (
+    add_months, create_default_partitions, create_month_partitions, is_partitioned, month_start)
+
+
+# format of the dates stored as strings before version 2 ("%I:%M:%S%p-%B-%d-%Y")
+LEGACY_DATE_REGEX = r'^[0-9]{2}:[0-9]{2}:[0-9]{2}[AP]M-[A-Za-z]+-[0-9]{2}-[0-9]{4}$'
+LEGACY_DATE_FORMAT = 'HH12:MI:SSAM-FMMonth-DD-YYYY'
+
+
+def _column_type(connection, table_name, column_name):
+    return connection.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = :table_name AND column_name = :column_name"),
+        {'table_name': table_name, 'column_name': column_name}).scalar()
+
+
+def _constraint_exists(connection, constraint_name):
+    return connection.execute(text(
+        "SELECT 1 FROM pg_constraint WHERE conname = :constraint_name"),
+        {'constraint_name': constraint_name}).scalar() is not None
+
+
+def _column_is_identity(connection, table_name, column_name):
+    return connection.execute(text(
+        "SELECT is_identity FROM information_schema.columns "
+        "WHERE table_name = :table_name AND column_name = :column_name"),
+        {'table_name': table_name, 'column_name': column_name}).scalar() == 'YES'
+
+
+def migrate_identity_ids(connection):
+    """
+    This function turns the id columns of the interaction and product tables into bigint identity
+    columns, starting their sequences after the largest existing id. The default and the sequence
+    of the SERIAL id columns created by the first schema are dropped first.
+
+    :param connection: The SQLAlchemy connection inside the migration transaction.
+    """
+
+    for table_name in (ShopData.__table__.name, ShopData_Product.__table__.name):
+        if not _column_is_identity(connection, table_name, 'id'):
+            # the SERIAL id columns have a nextval default, which an identity column can not have
+            serial_sequence = connection.execute(text(
+                "SELECT pg_get_serial_sequence(:table_name, 'id')"),
+                {'table_name': f'"{table_name}"'}).scalar()
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" ALTER COLUMN id DROP DEFAULT'))
+            if serial_sequence is not None:
+                connection.execute(text(f'DROP SEQUENCE {serial_sequence}'))
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" ALTER COLUMN id TYPE BIGINT'))
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY'))
+        # start the sequence after the rows created with the random IDs
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', 'id'), "
+            f'COALESCE(MAX(id), 0) + 1, false) FROM "{table_name}"'))
+
+
+def migrate_typed_schema(connection):
+    """
+    This function converts the string columns of the interaction and product tables to typed
+    columns, backfilling the existing values: the dates to timestamptz, the prices to numeric
+    and the stock availability to boolean. The values that can not be converted are set to NULL.
+    It also adds the foreign key through code and the composite indexes of the analytics queries.
+
+    :param connection: The SQLAlchemy connection inside the migration transaction.
+    """
+
+    interaction_table = ShopData.__table__.name
+    product_table = ShopData_Product.__table__.name
+
+    # the partitioned tables created by db.create_all() have the typed schema already
+    if is_partitioned(connection, interaction_table):
+        return
+
+    for table_name in (interaction_table, product_table):
+        if _column_type(connection, table_name, 'date') != 'timestamp with time zone':
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" ALTER COLUMN date TYPE TIMESTAMPTZ USING '
+                f"CASE WHEN date ~ '{LEGACY_DATE_REGEX}' "
+                f"THEN to_timestamp(date, '{LEGACY_DATE_FORMAT}') ELSE NULL END"))
+
+    if _column_type(connection, interaction_table, 'Interaction') != 'text':
+        connection.execute(text(
+            f'ALTER TABLE "{interaction_table}" ALTER COLUMN "Interaction" TYPE TEXT'))
+
+    if _column_type(connection, product_table, 'price') != 'numeric':
+        connection.execute(text(
+            f'ALTER TABLE "{product_table}" ALTER COLUMN price TYPE NUMERIC(12, 2) USING '
+            "CASE WHEN regexp_replace(price, '[^0-9.]', '', 'g') ~ '^[0-9]+([.][0-9]+)?$' "
+            "THEN regexp_replace(price, '[^0-9.]', '', 'g')::NUMERIC(12, 2) ELSE NULL END"))
+
+    if _column_type(connection, product_table, 'stock_availability') != 'boolean':
+        connection.execute(text(
+            f'ALTER TABLE "{product_table}" ALTER COLUMN stock_availability TYPE BOOLEAN USING '
+            "CASE lower(trim(stock_availability)) WHEN 'true' THEN true "
+            "WHEN 'false' THEN false ELSE NULL END"))
+
+    if _column_type(connection, product_table, 'description') != 'text':
+        connection.execute(text(
+            f'ALTER TABLE "{product_table}" ALTER COLUMN description TYPE TEXT'))
+
+    if not _constraint_exists(connection, f'{interaction_table}_code_key'):
+        connection.execute(text(
+            f'ALTER TABLE "{interaction_table}" ADD CONSTRAINT "{interaction_table}_code_key" UNIQUE (code)'))
+
+    # the legacy product rows are not validated against the interaction table
+    if not _constraint_exists(connection, 'fk_shop_data_product_code'):
+        connection.execute(text(
+            f'ALTER TABLE "{product_table}" ADD CONSTRAINT fk_shop_data_product_code '
+            f'FOREIGN KEY (code) REFERENCES "{interaction_table}" (code) ON DELETE CASCADE NOT VALID'))
+
+    connection.execute(text(
+        f'CREATE INDEX IF NOT EXISTS ix_shop_data_username_date ON "{interaction_table}" (username, date)'))
+    connection.execute(text(
+        f'CREATE INDEX IF NOT EXISTS ix_shop_data_product_name_date ON "{product_table}" (product_name, date)'))
+
+
+def migrate_partitioned_tables(connection):
+    """
+    This function replaces the interaction and product tables by tables partitioned by month on
+    the date. The existing tables are renamed to *_legacy, the partitions of their months are
+    created and their rows are copied. The rows without date are kept in the default partitions
+    with the epoch as date, and the product rows without interaction row stay only in the legacy
+    product table.
+
+    :param connection: The SQLAlchemy connection inside the migration transaction.
+    """
+
+    interaction_table = ShopData.__table__.name
+    product_table = ShopData_Product.__table__.name
+
+    # the tables created by db.create_all() are already partitioned
+    if is_partitioned(connection, interaction_table):
+        return
+
+    # free the names of the constraints, indexes and sequences of the new tables
+    connection.execute(text(
+        f'ALTER TABLE "{product_table}" DROP CONSTRAINT IF EXISTS fk_shop_data_product_code'))
+    connection.execute(text(
+        f'ALTER TABLE "{interaction_table}" DROP CONSTRAINT IF EXISTS "{interaction_table}_code_key"'))
+    for index in ShopData.__table__.indexes | ShopData_Product.__table__.indexes:
+        connection.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+    for table_name in (interaction_table, product_table):
+        connection.execute(text(
+            f'ALTER TABLE "{table_name}" ALTER COLUMN id DROP IDENTITY IF EXISTS'))
+        connection.execute(text(
+            f'ALTER TABLE "{table_name}" RENAME CONSTRAINT "{table_name}_pkey" TO "{table_name}_legacy_pkey"'))
+        connection.execute(text(
+            f'ALTER TABLE "{table_name}" RENAME TO "{table_name}_legacy"'))
+
+    ShopData.__table__.create(connection)
+    ShopData_Product.__table__.create(connection)
+
+    # partitions of the months of the existing rows and of the coming months
+    create_default_partitions(connection)
+    months = connection.execute(text(
+        f"SELECT DISTINCT date_trunc('month', date AT TIME ZONE 'UTC') "
+        f'FROM "{interaction_table}_legacy" WHERE date IS NOT NULL')).scalars().all()
+    current = month_start()
+    months = {month_start(month.replace(tzinfo=datetime.timezone.utc)) for month in months}
+    months.update(add_months(current, offset) for offset in range(0, 3))
+    for month in sorted(months):
+        create_month_partitions(connection, month)
+
+    connection.execute(text(
+        f'INSERT INTO "{interaction_table}" (id, code, date, username, "Interaction") '
+        f"SELECT id, COALESCE(code, 'legacy-' || id), COALESCE(date, 'epoch'), username, "
+        f'"Interaction" FROM "{interaction_table}_legacy"'))
+    # the product rows take the date of their interaction row, the key of the foreign key
+    connection.execute(text(
+        f'INSERT INTO "{product_table}" (id, code, date, username, product_name, price, '
+        f'description, stock_availability) '
+        f"SELECT p.id, p.code, COALESCE(i.date, 'epoch'), p.username, p.product_name, p.price, "
+        f'p.description, p.stock_availability FROM "{product_table}_legacy" p '
+        f'JOIN "{interaction_table}_legacy" i ON i.code = p.code'))
+
+    for table_name in (interaction_table, product_table):
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', 'id'), "
+            f'COALESCE(MAX(id), 0) + 1, false) FROM "{table_name}"'))
+
+
+def migrate_token_accounting(connection):
+    """
+    This function adds the session ID and the token accounting columns to the interaction table,
+    and their index. The columns added to the partitioned table are added to its partitions.
+
+    :param connection: The SQLAlchemy connection inside the migration transaction.
+    """
+
+    interaction_table = ShopData.__table__.name
+
+    for column_name, column_type in (
+            ('session_id', 'VARCHAR'), ('prompt_tokens', 'INTEGER'),
+            ('completion_tokens', 'INTEGER'), ('token_cost', 'NUMERIC(12, 6)')):
+        connection.execute(text(
+            f'ALTER TABLE "{interaction_table}" ADD COLUMN IF NOT EXISTS {column_name} {column_type}'))
+
+    connection.execute(text(
+        f'CREATE INDEX IF NOT EXISTS ix_shop_data_session_id_date ON "{interaction_table}" (session_id, date)'))
+
+
+# list of (version, description, migration function) in order
+MIGRATIONS = [
+    (1, 'identity IDs for the interaction and product tables', migrate_identity_ids),
+    (2, 'typed columns, foreign key and composite indexes', migrate_typed_schema),
+    (3, 'monthly partitions of the interaction and product tables', migrate_partitioned_tables),
+    (4, 'session ID and token accounting of the interaction table', migrate_token_accounting),
+]
+
+
+def run_migrations(engine=None):
+    """
+    This function applies the pending migrations of the ShopBot database, each one in its own
+    transaction.
+
+    :param engine: The SQLAlchemy engine of the database.
+
+    :return int: The schema version of the database after the migrations.
+    """
+
+    if engine.dialect.name != 'postgresql':
+        return MIGRATIONS[-1][0]
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS shopbot_schema_version ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, "
+            "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"))
+        current = connection.execute(text(
+            "SELECT COALESCE(MAX(version), 0) FROM shopbot_schema_version")).scalar()
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as connection:
+            # serialize the migrations of several workers starting together
+            connection.execute(text("SELECT pg_advisory_xact_lock(8361)"))
+            applied = connection.execute(text(
+                "SELECT 1 FROM shopbot_schema_version WHERE version = :version"),
+                {'version': version}).scalar()
+            if applied:
+                continue
+            migration(connection)
+            connection.execute(text(
+                "INSERT INTO shopbot_schema_version (version, description) "
+                "VALUES (:version, :description)"),
+                {'version': version, 'description': description})
+        print(version, description, 'schema_migration')
+        current = version
+
+    return current
@@ -0,0 +1,536 @@
+"""
+This mock_openai.py code contains a local stand-in of the OpenAI API for the
+benchmarks of the ShopBot API without network access or OpenAI key. It serves
+the endpoints used by app.py and app_async.py: chat.completions (with forced
+tool calls and streamed outputs) and the beta assistants, threads, messages
+and runs (with tool calls, tool outputs and cancellation). The latency of the
+completions and of the runs follows configurable distributions, and the tool
+arguments are resolved from the JSON catalog sent in the messages, so the
+whole pipeline of the API runs as with the real model.
+
+Run it with: python mock_openai.py --port 8001 --latency run=lognormal:1.0:0.4
+and start the API with SHOPBOT_OPENAI_BASE_URL=http://localhost:8001/v1
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+from catalog import tokenize
+from catalog_pool import stub_catalog_generator
+
+# prefix of the messages carrying the JSON catalog (see catalog_message_content)
+CATALOG_PREFIX = 'The JSON input catalog is: '
+
+# default latency of every kind of call, in seconds
+DEFAULT_LATENCIES = {
+    'request': 'constant:0.0',
+    'completion': 'lognormal:0.6:0.4',
+    'run': 'lognormal:1.0:0.4',
+}
+
+
+class Latency:
+    """
+    This class samples the latency of a kind of call from a distribution given as a
+    'name:param:param' specification:
+    constant:seconds, uniform:low:high, normal:mean:sd, lognormal:median:sigma and exponential:mean.
+    """
+
+    def __init__(self, spec='constant:0.0', rng=None):
+        """
+        :param spec (str): The specification of the distribution.
+        :param rng (Optional[random.Random]): The random generator.
+        """
+
+        self.spec = spec
+        self.rng = rng or random.Random()
+        name, *params = spec.split(':')
+        self.name = name
+        self.params = [float(param) for param in params]
+        if name not in ('constant', 'uniform', 'normal', 'lognormal', 'exponential'):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        """
+        This function samples a latency.
+
+        :return float: The latency in seconds, never negative.
+        """
+
+        if self.name == 'constant':
+            value = self.params[0]
+        elif self.name == 'uniform':
+            value = self.rng.uniform(self.params[0], self.params[1])
+        elif self.name == 'normal':
+            value = self.rng.gauss(self.params[0], self.params[1])
+        elif self.name == 'lognormal':
+            value = self.params[0] * self.rng.lognormvariate(0.0, self.params[1])
+        else:
+            value = self.rng.expovariate(1.0 / self.params[0])
+        return max(value, 0.0)
+
+
+def parse_latencies(specs=None, seed=None):
+    """
+    This function builds the latencies of every kind of call from 'kind=spec' strings.
+
+    :param specs (Optional[List[str]]): The specifications overriding the default latencies,
+    e.g. ['run=uniform:0.5:2.0'].
+    :param seed (Optional[int]): The seed of the random generator.
+
+    :return dict: A map from the kind of call ('request', 'completion', 'run') to its Latency.
+    """
+
+    rng = random.Random(seed)
+    latencies = dict(DEFAULT_LATENCIES)
+    for spec in specs or []:
+        kind, _, value = spec.partition('=')
+        if kind not in latencies:
+            raise ValueError(f"Unknown kind of call: {kind}")
+        latencies[kind] = value
+    return {kind: Latency(spec=spec, rng=rng) for kind, spec in latencies.items()}
+
+
+def count_tokens(text=None):
+    # rough count of 4 characters per token
+    return max(1, len(str(text or '')) // 4)
+
+
+def find_product(catalog=None, text=None):
+    """
+    This function finds the product of the catalog sharing the most words with a message, as the
+    model would do.
+
+    :param catalog (Optional[List[dict]]): The products of the JSON catalog.
+    :param text (Optional[str]): The user message.
+
+    :return Optional[dict]: The product, or None if no product name shares a word.
+    """
+
+    words = set(tokenize(text))
+    best, best_score = None, 0
+    for product in catalog or []:
+        score = len(words & set(tokenize(product.get('product_name'))))
+        if score > best_score:
+            best, best_score = product, score
+    return best
+
+
+def tool_arguments(name=None, catalog=None, text=None):
+    """
+    This function returns the arguments of a ShopBot tool call for a message.
+
+    :param name (Optional[str]): The tool name.
+    :param catalog (Optional[List[dict]]): The products of the JSON catalog.
+    :param text (Optional[str]): The user message.
+
+    :return str: The JSON arguments of the tool call.
+    """
+
+    product = find_product(catalog=catalog, text=text) or {}
+    if name == 'getProductInfo':
+        arguments = {'productName': product.get('product_name', 'null')}
+    elif name == 'getInformation':
+        arguments = {'price': str(product.get('price', 'null')),
+                     'description_val': str(product.get('description', 'null'))}
+    elif name == 'checkStock':
+        arguments = {'checkValue': str(product.get('stock_avail', 'null'))}
+    else:
+        arguments = {}
+    return json.dumps(arguments)
+
+
+def parse_context(messages=None):
+    """
+    This function extracts the JSON catalog and the last user message of a conversation.
+
+    :param messages (Optional[List[dict]]): The messages with 'role' and text 'content'.
+
+    :return Tuple[List[dict], str]: The products of the last catalog and the last user message.
+    """
+
+    catalog, text = [], ''
+    for message in messages or []:
+        content = message.get('content') or ''
+        if content.startswith(CATALOG_PREFIX):
+            try:
+                catalog = json.loads(content[len(CATALOG_PREFIX):])
+            except ValueError:
+                catalog = []
+        elif message.get('role') == 'user':
+            text = content[len('user: '):] if content.startswith('user: ') else content
+    return catalog, text
+
+
+def chat_answer(text=None):
+    """
+    This function returns the free-form answer of the assistant to a message.
+
+    :param text (Optional[str]): The user message.
+
+    :return str: The answer.
+    """
+
+    if 'bye' in str(text).lower():
+        return "Goodbye! Thank you for shopping with the ShopBot."
+    return "Hello! I am the ShopBot, I can tell you the price, description and stock of our products."
+
+
+class MockOpenAI:
+    """
+    This class keeps the state of the mock OpenAI API: assistants, threads, messages and runs.
+    """
+
+    def __init__(self, latencies=None, seed=None):
+        """
+        :param latencies (Optional[dict]): The latency of every kind of call (see parse_latencies).
+        :param seed (Optional[int]): The seed of the random generators.
+        """
+
+        self.latencies = latencies or parse_latencies(seed=seed)
+        self.generate_catalog = stub_catalog_generator(seed=seed)
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self.assistants = {}
+        self.threads = {}
+        self.runs = {}
+
+    def new_id(self, prefix=None):
+        return f'{prefix}_mock{next(self._counter):08d}{uuid.uuid4().hex[:8]}'
+
+    def sleep(self, kind=None):
+        time.sleep(self.latencies[kind].sample())
+
+    def add_message(self, thread_id=None, role='user', content='', assistant_id=None, run_id=None):
+        message = {
+            'id': self.new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'status': 'completed',
+            'role': role,
+            'content': [{'type': 'text', 'text': {'value': content, 'annotations': []}}],
+            'assistant_id': assistant_id,
+            'run_id': run_id,
+            'attachments': [],
+            'metadata': {}}
+        self.threads[thread_id]['messages'].append(message)
+        return message
+
+    def thread_context(self, thread_id=None):
+        return [{'role': message['role'], 'content': message['content'][0]['text']['value']}
+                for message in self.threads[thread_id]['messages']]
+
+    def refresh_run(self, run=None):
+        """
+        This function moves a run to its next status once its latency has elapsed.
+
+        :param run (Optional[dict]): The run state.
+
+        :return dict: The run object returned by the API.
+        """
+
+        if run['status'] in ('queued', 'in_progress') and time.monotonic() >= run['_ready_at']:
+            thread_id = run['thread_id']
+            if run['_tool_rounds']:
+                catalog, text = parse_context(self.thread_context(thread_id))
+                run['status'] = 'requires_action'
+                run['required_action'] = {
+                    'type': 'submit_tool_outputs',
+                    'submit_tool_outputs': {'tool_calls': [
+                        {'id': self.new_id('call'), 'type': 'function',
+                         'function': {'name': name, 'arguments': tool_arguments(
+                             name=name, catalog=catalog, text=text)}}
+                        for name in run['_tool_rounds'][0]]}}
+            else:
+                context = self.thread_context(thread_id)
+                catalog, text = parse_context(context)
+                if run['_tool_outputs']:
+                    answer = "This is the information of the product you asked for."
+                else:
+                    answer = chat_answer(text=text)
+                self.add_message(
+                    thread_id=thread_id, role='assistant', content=answer,
+                    assistant_id=run['assistant_id'], run_id=run['id'])
+                prompt_tokens = sum(count_tokens(message['content']) for message in context)
+                completion_tokens = count_tokens(answer)
+                run['status'] = 'completed'
+                run['required_action'] = None
+                run['completed_at'] = int(time.time())
+                run['usage'] = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens}
+        return {key: value for key, value in run.items() if not key.startswith('_')}
+
+
+def error_response(message=None, status=404):
+    return jsonify({'error': {'message': message, 'type': 'invalid_request_error'}}), status
+
+
+def list_response(data=None):
+    return jsonify({
+        'object': 'list', 'data': data,
+        'first_id': data[0]['id'] if data else None,
+        'last_id': data[-1]['id'] if data else None,
+        'has_more': False})
+
+
+def create_mock_app(state=None):
+    """
+    This function creates the Flask app of the mock OpenAI API.
+
+    :param state (Optional[MockOpenAI]): The state of the mock API.
+
+    :return Flask: The mock API app, serving the endpoints under /v1.
+    """
+
+    state = state or MockOpenAI()
+    app = Flask('mock_openai')
+
+    @app.before_request
+    def request_latency():
+        state.sleep('request')
+
+    @app.after_request
+    def poll_interval(response):
+        # the polling helpers of the OpenAI SDK wait this interval between refreshes
+        response.headers['openai-poll-after-ms'] = '50'
+        return response
+
+    @app.post('/v1/chat/completions')
+    def chat_completions():
+        body = request.get_json()
+        messages = body.get('messages') or []
+        catalog, text = parse_context(messages)
+        tool_choice = body.get('tool_choice')
+        completion_id = state.new_id('chatcmpl')
+        state.sleep('completion')
+
+        message = {'role': 'assistant', 'content': None}
+        finish_reason = 'stop'
+        if isinstance(tool_choice, dict):
+            name = tool_choice['function']['name']
+            message['tool_calls'] = [{
+                'id': state.new_id('call'), 'type': 'function',
+                'function': {'name': name, 'arguments': tool_arguments(
+                    name=name, catalog=catalog, text=text)}}]
+            finish_reason = 'tool_calls'
+        elif any('Mock catalog' in (item.get('content') or '') for item in messages):
+            with state._lock:
+                message['content'] = state.generate_catalog()
+        else:
+            message['content'] = chat_answer(text=text)
+
+        prompt_tokens = sum(count_tokens(item.get('content')) for item in messages)
+        completion_tokens = count_tokens(message['content'] or json.dumps(message.get('tool_calls')))
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                 'total_tokens': prompt_tokens + completion_tokens}
+
+        if body.get('stream'):
+            def chunks():
+                content = message['content'] or ''
+                for start in range(0, len(content), 64):
+                    yield 'data: ' + json.dumps({
+                        'id': completion_id, 'object': 'chat.completion.chunk',
+                        'created': int(time.time()), 'model': body.get('model'),
+                        'choices': [{'index': 0, 'delta': {'content': content[start:start + 64]},
+                                     'finish_reason': None}]}) + '\n\n'
+                yield 'data: ' + json.dumps({
+                    'id': completion_id, 'object': 'chat.completion.chunk',
+                    'created': int(time.time()), 'model': body.get('model'),
+                    'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}]}) + '\n\n'
+                yield 'data: [DONE]\n\n'
+            return Response(chunks(), mimetype='text/event-stream')
+
+        return jsonify({
+            'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason,
+                         'logprobs': None}],
+            'usage': usage})
+
+    @app.post('/v1/assistants')
+    def create_assistant():
+        body = request.get_json()
+        assistant = dict(
+            body, id=state.new_id('asst'), object='assistant', created_at=int(time.time()),
+            metadata=body.get('metadata') or {})
+        with state._lock:
+            state.assistants[assistant['id']] = assistant
+        return jsonify(assistant)
+
+    @app.get('/v1/assistants')
+    def list_assistants():
+        with state._lock:
+            data = list(reversed(list(state.assistants.values())))
+        return list_response(data)
+
+    @app.get('/v1/assistants/<assistant_id>')
+    def retrieve_assistant(assistant_id=None):
+        assistant = state.assistants.get(assistant_id)
+        if assistant is None:
+            return error_response(f"No assistant found with id '{assistant_id}'.")
+        return jsonify(assistant)
+
+    @app.post('/v1/threads')
+    def create_thread():
+        thread_id = state.new_id('thread')
+        with state._lock:
+            state.threads[thread_id] = {'messages': []}
+        return jsonify({'id': thread_id, 'object': 'thread', 'created_at': int(time.time()),
+                        'metadata': {}, 'tool_resources': None})
+
+    @app.post('/v1/threads/<thread_id>/messages')
+    def create_message(thread_id=None):
+        if thread_id not in state.threads:
+            return error_response(f"No thread found with id '{thread_id}'.")
+        body = request.get_json()
+        content = body.get('content')
+        if isinstance(content, list):
+            content = ''.join(part.get('text', '') for part in content)
+        with state._lock:
+            message = state.add_message(
+                thread_id=thread_id, role=body.get('role', 'user'), content=content)
+        return jsonify(message)
+
+    @app.get('/v1/threads/<thread_id>/messages')
+    def list_messages(thread_id=None):
+        if thread_id not in state.threads:
+            return error_response(f"No thread found with id '{thread_id}'.")
+        with state._lock:
+            data = list(state.threads[thread_id]['messages'])
+        run_id = request.args.get('run_id')
+        if run_id:
+            data = [message for message in data if message['run_id'] == run_id]
+        if request.args.get('order', 'desc') == 'desc':
+            data.reverse()
+        return list_response(data[:int(request.args.get('limit', 20))])
+
+    @app.post('/v1/threads/<thread_id>/runs')
+    def create_run(thread_id=None):
+        if thread_id not in state.threads:
+            return error_response(f"No thread found with id '{thread_id}'.")
+        body = request.get_json()
+        if body.get('stream'):
+            return error_response("Streamed runs are not supported by the mock API.", 400)
+        # the tool calls of every requires_action step of the run; the tool choice
+        # only forces the first step, the model may call more tools after it
+        tool_choice = body.get('tool_choice')
+        if isinstance(tool_choice, dict):
+            tool_rounds = [[tool_choice['function']['name']]]
+        elif tool_choice == 'required':
+            with state._lock:
+                catalog, text = parse_context(state.thread_context(thread_id))
+            if not find_product(catalog=catalog, text=text):
+                tool_rounds = [['getProductInfo']]
+            elif body.get('parallel_tool_calls', True):
+                # a product message calls every tool at once if the calls may be parallel
+                tool_rounds = [['getProductInfo', 'getInformation', 'checkStock']]
+            else:
+                tool_rounds = [['getProductInfo'], ['getInformation'], ['checkStock']]
+        else:
+            tool_rounds = []
+
+        run = {
+            'id': state.new_id('run'), 'object': 'thread.run', 'created_at': int(time.time()),
+            'thread_id': thread_id, 'assistant_id': body.get('assistant_id'),
+            'status': 'queued', 'required_action': None, 'last_error': None,
+            'instructions': body.get('instructions'), 'tool_choice': tool_choice,
+            'parallel_tool_calls': body.get('parallel_tool_calls', True),
+            'model': 'gpt-4o', 'tools': [], 'usage': None, 'metadata': {},
+            '_tool_rounds': tool_rounds, '_tool_outputs': [],
+            '_ready_at': time.monotonic() + state.latencies['run'].sample()}
+        with state._lock:
+            state.runs[run['id']] = run
+            return jsonify(state.refresh_run(run))
+
+    @app.get('/v1/threads/<thread_id>/runs/<run_id>')
+    def retrieve_run(thread_id=None, run_id=None):
+        with state._lock:
+            run = state.runs.get(run_id)
+            if run is None or run['thread_id'] != thread_id:
+                return error_response(f"No run found with id '{run_id}'.")
+            return jsonify(state.refresh_run(run))
+
+    @app.post('/v1/threads/<thread_id>/runs/<run_id>/submit_tool_outputs')
+    def submit_tool_outputs(thread_id=None, run_id=None):
+        body = request.get_json()
+        with state._lock:
+            run = state.runs.get(run_id)
+            if run is None or run['thread_id'] != thread_id:
+                return error_response(f"No run found with id '{run_id}'.")
+            if run['status'] != 'requires_action':
+                return error_response(f"Runs in status {run['status']} do not accept tool outputs.", 400)
+            expected = {call['id'] for call in
+                        run['required_action']['submit_tool_outputs']['tool_calls']}
+            submitted = {output['tool_call_id'] for output in body.get('tool_outputs') or []}
+            if submitted != expected:
+                return error_response(
+                    "Expected tool outputs for call_ids " + ', '.join(sorted(expected)), 400)
+            run['_tool_outputs'].extend(body['tool_outputs'])
+            run['_tool_rounds'].pop(0)
+            run['status'] = 'queued'
+            run['required_action'] = None
+            run['_ready_at'] = time.monotonic() + state.latencies['run'].sample()
+            return jsonify(state.refresh_run(run))
+
+    @app.post('/v1/threads/<thread_id>/runs/<run_id>/cancel')
+    def cancel_run(thread_id=None, run_id=None):
+        with state._lock:
+            run = state.runs.get(run_id)
+            if run is None or run['thread_id'] != thread_id:
+                return error_response(f"No run found with id '{run_id}'.")
+            if run['status'] in ('queued', 'in_progress', 'requires_action'):
+                run['status'] = 'cancelled'
+                run['required_action'] = None
+            return jsonify(state.refresh_run(run))
+
+    return app
+
+
+def serve(host='127.0.0.1', port=8001, latencies=None, seed=None):
+    """
+    This function starts the mock OpenAI API in a background thread.
+
+    :param host (str): The host of the server.
+    :param port (int): The port of the server, 0 for a free port.
+    :param latencies (Optional[dict]): The latency of every kind of call (see parse_latencies).
+    :param seed (Optional[int]): The seed of the random generators.
+
+    :return Tuple: The server (with a shutdown method) and the base URL of the API.
+    """
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        # the access log of every mock call would flood the benchmark output
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server(
+        host, port, create_mock_app(MockOpenAI(latencies=latencies, seed=seed)), threaded=True,
+        request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, name='mock-openai', daemon=True).start()
+    return server, f'http://{host}:{server.port}/v1'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local mock of the OpenAI API used by the ShopBot.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency', action='append', default=[],
+                        help="latency of a kind of call, e.g. run=lognormal:1.0:0.4 "
+                             "(kinds: request, completion, run)")
+    args = parser.parse_args()
+
+    create_mock_app(MockOpenAI(latencies=parse_latencies(args.latency, seed=args.seed))).run(
+        host=args.host, port=args.port, threaded=True)
@@ -1,15 +1,65 @@
+import re
+from decimal import Decimal, InvalidOperation
+
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+# characters removed from the prices before converting them to numbers
+PRICE_PATTERN = re.compile(r'[^0-9.]')
+
+
+def to_price(value=None):
+    """
+    This function converts a catalog price (e.g. '$19.99') to a number for the price column.
+
+    :param value (Optional): The price value.
+
+    :return Optional[Decimal]: The price, or None if it is not a number.
+    """
+
+    try:
+        return Decimal(PRICE_PATTERN.sub('', str(value))).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def to_stock(value=None):
+    """
+    This function converts a catalog stock_avail value ('True'/'False') to a boolean.
+
+    :param value (Optional): The stock_avail value.
+
+    :return Optional[bool]: The stock availability, or None if it is unknown.
+    """
+
+    stock = str(value).strip().lower()
+    if stock in ('true', 'false'):
+        return stock == 'true'
+    return None
+
 
 class ShopData(db.Model):
 
-    id = db.Column(db.Integer, primary_key=True, index=True)
-    code = db.Column(db.String)
-    date = db.Column(db.String)
+    # database-generated identity key, with the date as partition key (see partitions.py)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'),
+                   db.Identity(), primary_key=True, index=True)
+    code = db.Column(db.String, nullable=False)
+    date = db.Column(db.DateTime(timezone=True), primary_key=True)
     username = db.Column(db.String)
-    Interaction = db.Column(db.String)
+    Interaction = db.Column(db.Text)
+    # tokens and cost of the GPT runs and completions of the message (see metrics.TokenMeter)
+    session_id = db.Column(db.String)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    token_cost = db.Column(db.Numeric(12, 6))
+
+    __table_args__ = (
+        db.UniqueConstraint('code', 'date', name='uq_shop_data_code_date'),
+        db.Index('ix_shop_data_username_date', 'username', 'date'),
+        db.Index('ix_shop_data_session_id_date', 'session_id', 'date'),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
 
     def __hash__(self):
         return hash(self.name)
@@ -20,14 +70,24 @@ class ShopData(db.Model):
 
 class ShopData_Product(db.Model):
 
-    id = db.Column(db.Integer, primary_key=True, index=True)
-    code = db.Column(db.String)
-    date = db.Column(db.String)
+    # database-generated identity key, with the date as partition key (see partitions.py)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'),
+                   db.Identity(), primary_key=True, index=True)
+    code = db.Column(db.String, nullable=False)
+    date = db.Column(db.DateTime(timezone=True), primary_key=True)
     username = db.Column(db.String)
     product_name = db.Column(db.String)
-    price = db.Column(db.String)
-    description = db.Column(db.String)
-    stock_availability = db.Column(db.String)
+    price = db.Column(db.Numeric(12, 2))
+    description = db.Column(db.Text)
+    stock_availability = db.Column(db.Boolean)
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ['code', 'date'], ['shop_data.code', 'shop_data.date'],
+            name='fk_shop_data_product_code', ondelete='CASCADE'),
+        db.Index('ix_shop_data_product_name_date', 'product_name', 'date'),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
 
     def __hash__(self):
         return hash(self.name)
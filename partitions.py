@@ -0,0 +1,349 @@
+"""
+This partitions.py code contains the monthly partitioning of the ShopBot
+interaction and product tables. Both tables are range partitioned by date in
+postgresql, one partition per month plus a default partition. A background
+thread creates the partitions of the coming months ahead of time and applies
+the retention policy: the partitions older than the retention period are
+detached from the tables, dumped to a compressed CSV archive and dropped, so
+the size of the hot tables stays bounded as the chat volume grows. A partition
+left detached by a failed archive is found again by its name on the next run
+and archived before it is dropped.
+"""
+
+import csv
+import datetime
+import gzip
+import os
+import re
+import threading
+
+from sqlalchemy import text
+
+from models_database import ShopData, ShopData_Product
+
+# name suffix of the monthly partitions (e.g. shop_data_p2024_09)
+PARTITION_PATTERN = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+def month_start(value=None):
+    """
+    This function returns the first instant of the month of a date, in UTC.
+
+    :param value (Optional[datetime.datetime]): The date, now if it is not given.
+
+    :return datetime.datetime: The first instant of the month.
+    """
+
+    if value is None:
+        value = datetime.datetime.now(datetime.timezone.utc)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(value=None, months=0):
+    """
+    This function moves the first instant of a month by a number of months.
+
+    :param value (Optional[datetime.datetime]): The first instant of a month.
+    :param months (int): The number of months, negative to move back.
+
+    :return datetime.datetime: The first instant of the resulting month.
+    """
+
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table_name=None, month=None):
+    """
+    This function returns the name of the partition of a table for a month.
+
+    :param table_name (Optional[str]): The name of the partitioned table.
+    :param month (Optional[datetime.datetime]): The first instant of the month.
+
+    :return str: The partition name.
+    """
+
+    return f'{table_name}_p{month.year:04d}_{month.month:02d}'
+
+
+def is_partitioned(connection=None, table_name=None):
+    """
+    This function checks if a table is a partitioned table.
+
+    :param connection (Optional[Connection]): The SQLAlchemy connection.
+    :param table_name (Optional[str]): The table name.
+
+    :return bool: True if the table is partitioned.
+    """
+
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table_name AND pg_table_is_visible(c.oid)"),
+        {'table_name': table_name}).scalar() is not None
+
+
+def create_month_partitions(connection=None, month=None):
+    """
+    This function creates the partitions of the interaction and product tables for a month,
+    if they do not exist yet.
+
+    :param connection (Optional[Connection]): The SQLAlchemy connection.
+    :param month (Optional[datetime.datetime]): The first instant of the month.
+    """
+
+    lower = month.isoformat()
+    upper = add_months(month, 1).isoformat()
+    for table in (ShopData.__table__, ShopData_Product.__table__):
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{partition_name(table.name, month)}" '
+            f'PARTITION OF "{table.name}" FOR VALUES FROM (\'{lower}\') TO (\'{upper}\')'))
+
+
+def create_default_partitions(connection=None):
+    """
+    This function creates the default partitions of the interaction and product tables, which
+    keep the rows outside of the monthly partitions.
+
+    :param connection (Optional[Connection]): The SQLAlchemy connection.
+    """
+
+    for table in (ShopData.__table__, ShopData_Product.__table__):
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{table.name}_default" '
+            f'PARTITION OF "{table.name}" DEFAULT'))
+
+
+def list_month_partitions(connection=None, table_name=None):
+    """
+    This function lists the monthly partitions attached to a table.
+
+    :param connection (Optional[Connection]): The SQLAlchemy connection.
+    :param table_name (Optional[str]): The name of the partitioned table.
+
+    :return List[Tuple[datetime.datetime, str]]: The month and name of every partition, sorted
+    by month.
+    """
+
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = :table_name AND pg_table_is_visible(parent.oid)"),
+        {'table_name': table_name}).scalars().all()
+
+    return month_partitions(table_name, names)
+
+
+def list_detached_partitions(connection=None, table_name=None):
+    """
+    This function lists the monthly partitions of a table that were detached but not dropped,
+    i.e. the standalone tables named as its monthly partitions.
+
+    :param connection (Optional[Connection]): The SQLAlchemy connection.
+    :param table_name (Optional[str]): The name of the partitioned table.
+
+    :return List[Tuple[datetime.datetime, str]]: The month and name of every detached partition,
+    sorted by month.
+    """
+
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relkind = 'r' AND NOT c.relispartition "
+        "AND starts_with(c.relname, :table_name) AND pg_table_is_visible(c.oid)"),
+        {'table_name': table_name + '_p'}).scalars().all()
+    return month_partitions(table_name, names)
+
+
+def month_partitions(table_name=None, names=None):
+    """
+    This function keeps the monthly partition names of a table and parses their month.
+
+    :param table_name (Optional[str]): The name of the partitioned table.
+    :param names (Optional[List[str]]): The table names.
+
+    :return List[Tuple[datetime.datetime, str]]: The month and name of every partition, sorted
+    by month.
+    """
+
+    partitions = []
+    for name in names:
+        match = PARTITION_PATTERN.search(name)
+        if match and name == table_name + match.group(0):
+            month = datetime.datetime(
+                int(match.group(1)), int(match.group(2)), 1, tzinfo=datetime.timezone.utc)
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+class PartitionManager:
+    """
+    This class creates the monthly partitions ahead of time and applies the retention policy.
+    """
+
+    def __init__(
+            self,
+            engine=None,
+            premake_months=2,
+            retention_months=0,
+            archive_dir=None,
+            interval_seconds=3600.0):
+        """
+        :param engine (Optional[Engine]): The SQLAlchemy engine of the database.
+        :param premake_months (int): The number of months after the current one whose partitions
+        are created ahead of time.
+        :param retention_months (int): The number of months kept in the tables, including the
+        current one. The older partitions are detached; 0 keeps every partition.
+        :param archive_dir (Optional[str]): The directory where the detached partitions are dumped
+        as gzipped CSV files before they are dropped. If it is not given the detached partitions
+        are kept as standalone tables.
+        :param interval_seconds (float): The seconds between two maintenance runs of the thread.
+        """
+
+        self.engine = engine
+        self.premake_months = premake_months
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.engine is not None and self.engine.dialect.name == 'postgresql'
+
+    def ensure_partitions(self, now=None):
+        """
+        This function creates the partitions of the current month and of the coming months.
+
+        :param now (Optional[datetime.datetime]): The current date.
+        """
+
+        if not self.enabled:
+            return
+        current = month_start(now)
+        with self.engine.begin() as connection:
+            # serialize the maintenance of several workers
+            connection.execute(text("SELECT pg_advisory_xact_lock(8362)"))
+            if not is_partitioned(connection, ShopData.__table__.name):
+                return
+            create_default_partitions(connection)
+            for months in range(0, self.premake_months + 1):
+                create_month_partitions(connection, add_months(current, months))
+
+    def apply_retention(self, now=None):
+        """
+        This function detaches the partitions older than the retention period, and dumps and drops
+        them if an archive directory is configured. The partitions detached by a previous run whose
+        archive failed are archived again first.
+
+        :param now (Optional[datetime.datetime]): The current date.
+
+        :return List[str]: The names of the detached partitions.
+        """
+
+        if not self.enabled or (self.retention_months <= 0 and not self.archive_dir):
+            return []
+
+        cutoff = add_months(month_start(now), -(self.retention_months - 1))
+        pending = []
+        detached = []
+        with self.engine.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(8362)"))
+            # the product partitions first, they reference the interaction partitions
+            for table in (ShopData_Product.__table__, ShopData.__table__):
+                if self.archive_dir:
+                    pending.extend(
+                        name for _, name in list_detached_partitions(connection, table.name))
+                if self.retention_months <= 0:
+                    continue
+                for month, name in list_month_partitions(connection, table.name):
+                    if month >= cutoff:
+                        continue
+                    connection.execute(text(
+                        f'ALTER TABLE "{table.name}" DETACH PARTITION "{name}"'))
+                    # the detached product partition keeps a copy of the foreign key
+                    connection.execute(text(
+                        f'ALTER TABLE "{name}" DROP CONSTRAINT IF EXISTS fk_shop_data_product_code'))
+                    detached.append(name)
+
+        for name in pending:
+            print(name, 'partition_archive_retry')
+            self.archive(name)
+        for name in detached:
+            print(name, 'partition_detached')
+            if self.archive_dir:
+                self.archive(name)
+        return detached
+
+    def archive(self, name=None):
+        """
+        This function dumps a detached partition to a gzipped CSV file and drops it.
+
+        :param name (Optional[str]): The name of the detached partition.
+
+        :return Optional[str]: The path of the archive, or None if the dump failed and the
+        partition was kept, to be archived again by the next run.
+        """
+
+        path = os.path.join(self.archive_dir, name + '.csv.gz')
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with self.engine.connect() as connection:
+                result = connection.execution_options(stream_results=True).execute(
+                    text(f'SELECT * FROM "{name}"'))
+                with gzip.open(path + '.tmp', 'wt', newline='', encoding='utf-8') as file:
+                    writer = csv.writer(file)
+                    writer.writerow(result.keys())
+                    for row in result:
+                        writer.writerow(row)
+            os.replace(path + '.tmp', path)
+            with self.engine.begin() as connection:
+                connection.execute(text(f'DROP TABLE "{name}"'))
+        except Exception as error:
+            print(error, 'partition_archive_error')
+            return None
+        print(path, 'partition_archived')
+        return path
+
+    def run(self, now=None):
+        """
+        This function runs the maintenance: partitions ahead of time and retention policy.
+
+        :param now (Optional[datetime.datetime]): The current date.
+        """
+
+        try:
+            self.ensure_partitions(now)
+            self.apply_retention(now)
+        except Exception as error:
+            print(error, 'partition_maintenance_error')
+
+    def start(self):
+        """
+        This function runs the maintenance once and starts the background thread repeating it.
+
+        :return PartitionManager: The manager itself.
+        """
+
+        self.run()
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._loop, name='partition-manager', daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.run()
+
+    def stop(self):
+        """
+        This function stops the background maintenance thread.
+        """
+
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
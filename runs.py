@@ -0,0 +1,398 @@
+"""
+This runs.py code contains the completion of the GPT assistant runs shared by
+app.py and app_stream.py. A run is refreshed from the API (runs.retrieve) with
+an exponential backoff with jitter until it reaches a terminal status or
+requires an action, instead of checking a stale run object, and it is
+cancelled when its timeout expires. The latency of every phase is recorded in
+a PhaseTimer. The answer of a run is retrieved alone, filtering the thread
+messages by the run, instead of listing a page of the thread history.
+The async_* functions are the same completion for the async OpenAI client of
+app_async.py, so a run that times out (or whose request is cancelled) is also
+cancelled on the API instead of keeping the thread locked.
+"""
+
+import asyncio
+import random
+import time
+
+from metrics import PhaseTimer
+
+# statuses after which a run does not change anymore
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled', 'incomplete')
+
+# latency of the run phases of the API
+run_timer = PhaseTimer()
+
+
+class RunError(Exception):
+    """
+    This exception is raised when a GPT assistant run is not completed.
+    """
+
+    def __init__(self, message=None, run=None):
+        super().__init__(message)
+        self.run = run
+
+
+class RunTimeoutError(RunError):
+    """
+    This exception is raised when a GPT assistant run is not finished before its timeout.
+    """
+
+
+def ensure_completed(run=None):
+    """
+    This function checks that a GPT assistant run is completed.
+
+    :param run (Optional): The GPT assistant run object.
+
+    :return: The same run object.
+    :raises RunError: If the run failed, expired, was cancelled or is not finished.
+    """
+
+    if run.status == 'completed':
+        return run
+    if run.status == 'failed':
+        raise RunError(f"Run failed with error: {run.last_error}", run=run)
+    raise RunError(f"Run {run.id} is {run.status}", run=run)
+
+
+def backoff_delays(initial_delay=0.25, max_delay=2.0, jitter=0.2):
+    """
+    This function generates the delays between two refreshes of a run: an exponential backoff
+    from initial_delay up to max_delay, with a random fraction of jitter added to every delay.
+
+    :param initial_delay (float): The first delay in seconds.
+    :param max_delay (float): The maximum delay in seconds.
+    :param jitter (float): The random fraction added to every delay.
+
+    :return Iterator[float]: The endless delays in seconds.
+    """
+
+    delay = initial_delay
+    while True:
+        yield delay * (1 + random.uniform(0, jitter))
+        delay = min(delay * 2, max_delay)
+
+
+def cancel_run(client=None, thread_id=None, run_id=None):
+    """
+    This function cancels a GPT assistant run, so its thread accepts new messages and runs again.
+    The errors are only printed, e.g. if the run finished in the meantime.
+
+    :param client (Optional[OpenAI]): The OpenAI client.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param run_id (Optional[str]): The ID of the run.
+    """
+
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as error:
+        print(error, 'run_cancel_error')
+
+
+def wait_for_run(
+        client=None,
+        run=None,
+        thread_id=None,
+        timeout_seconds=120,
+        phase='run',
+        stop_on_action=True,
+        initial_delay=0.25,
+        max_delay=2.0,
+        jitter=0.2,
+        timer=run_timer,
+        sleep=time.sleep,
+        clock=time.monotonic):
+    """
+    This function waits until a GPT assistant run reaches a terminal status, or requires an action,
+    refreshing it from the API with an exponential backoff with jitter. The run is cancelled if
+    the timeout expires.
+
+    :param client (Optional[OpenAI]): The OpenAI client.
+    :param run (Optional): The GPT assistant run object returned by the API.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param timeout_seconds (float): The maximum seconds to wait for the run.
+    :param phase (str): The phase name of the run for the timing metrics.
+    :param stop_on_action (bool): True to return when the run requires an action (tool outputs).
+    :param initial_delay (float): The first delay between two refreshes in seconds.
+    :param max_delay (float): The maximum delay between two refreshes in seconds.
+    :param jitter (float): The random fraction added to every delay.
+    :param timer (PhaseTimer): The timer of the run phases.
+    :param sleep (Callable[[float], None]): The sleep function.
+    :param clock (Callable[[], float]): The monotonic clock.
+
+    :return: The refreshed run object.
+    :raises RunTimeoutError: If the run is not finished before the timeout, after cancelling it.
+    """
+
+    start = clock()
+    deadline = start + timeout_seconds
+    delays = backoff_delays(initial_delay=initial_delay, max_delay=max_delay, jitter=jitter)
+
+    while run.status not in TERMINAL_STATUSES and not (
+            stop_on_action and run.status == 'requires_action'):
+        remaining = deadline - clock()
+        if remaining <= 0:
+            cancel_run(client=client, thread_id=thread_id, run_id=run.id)
+            timer.record(phase=phase, seconds=clock() - start, outcome='timeout')
+            raise RunTimeoutError(
+                f"Run {run.id} was not finished after {timeout_seconds} seconds", run=run)
+
+        sleep(min(next(delays), remaining))
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+    timer.record(phase=phase, seconds=clock() - start, outcome=run.status)
+    return run
+
+
+def complete_run(
+        client=None,
+        run=None,
+        thread_id=None,
+        timeout_seconds=120,
+        phase='run',
+        dispatch=None,
+        max_tool_rounds=4):
+    """
+    This function completes a GPT assistant run: it waits for the run and, as long as the run
+    requires an action, submits the outputs of every tool call (empty unless a dispatch function
+    is given) and waits again, until the run reaches a terminal status. The model may call more
+    tools after receiving the outputs of the first ones, e.g. checkStock after getInformation.
+
+    :param client (Optional[OpenAI]): The OpenAI client.
+    :param run (Optional): The GPT assistant run object returned by runs.create.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param timeout_seconds (float): The maximum seconds to wait for each phase of the run.
+    :param phase (str): The phase name of the run for the timing metrics.
+    :param dispatch (Optional[Callable]): The function returning the output of each tool call
+    (e.g. shopbot_tools.ToolDispatcher).
+    :param max_tool_rounds (int): The maximum number of tool output submissions of the run.
+
+    :return Tuple: A tuple containing:
+    - run: The completed run object.
+    - tool_value: The submit_tool_outputs object with the tool calls of the first action of the
+      run, or None.
+    :raises RunError: If the run is not completed, or still requires an action after
+    max_tool_rounds submissions (the run is cancelled).
+    """
+
+    run = wait_for_run(
+        client=client, run=run, thread_id=thread_id, timeout_seconds=timeout_seconds,
+        phase=phase)
+
+    tool_value = None
+    rounds = 0
+    while run.status == 'requires_action':
+        if rounds >= max_tool_rounds:
+            cancel_run(client=client, thread_id=thread_id, run_id=run.id)
+            raise RunError(
+                f"Run {run.id} still requires an action after {rounds} tool rounds", run=run)
+
+        submit_tool_outputs, tool_outputs = _tool_outputs(run=run, dispatch=dispatch)
+        if tool_value is None:
+            tool_value = submit_tool_outputs
+
+        # send the tool outputs back and wait for the next action or the end of the run
+        with run_timer.time(phase=phase + '.submit_tool_outputs'):
+            run = client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs)
+        run = wait_for_run(
+            client=client, run=run, thread_id=thread_id, timeout_seconds=timeout_seconds,
+            phase=phase + '.after_tool_outputs')
+        rounds += 1
+
+    return ensure_completed(run), tool_value
+
+
+def _tool_outputs(run=None, dispatch=None):
+    submit_tool_outputs = run.required_action.submit_tool_outputs
+    return submit_tool_outputs, [
+        {"tool_call_id": tool_call.id, "output": dispatch(tool_call) if dispatch else ""}
+        for tool_call in submit_tool_outputs.tool_calls]
+
+
+async def async_cancel_run(aclient=None, thread_id=None, run_id=None):
+    """
+    This function cancels a GPT assistant run with the async OpenAI client (see cancel_run).
+
+    :param aclient (Optional[AsyncOpenAI]): The async OpenAI client.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param run_id (Optional[str]): The ID of the run.
+    """
+
+    try:
+        await aclient.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as error:
+        print(error, 'run_cancel_error')
+
+
+async def async_wait_for_run(
+        aclient=None,
+        run=None,
+        thread_id=None,
+        timeout_seconds=120,
+        phase='run',
+        stop_on_action=True,
+        initial_delay=0.25,
+        max_delay=2.0,
+        jitter=0.2,
+        timer=run_timer,
+        sleep=asyncio.sleep,
+        clock=time.monotonic):
+    """
+    This function waits for a GPT assistant run with the async OpenAI client (see wait_for_run).
+    The run is also cancelled on the API if the waiting task is cancelled, e.g. when the client
+    of the request disconnects.
+
+    :param aclient (Optional[AsyncOpenAI]): The async OpenAI client.
+    :param run (Optional): The GPT assistant run object returned by the API.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param timeout_seconds (float): The maximum seconds to wait for the run.
+    :param phase (str): The phase name of the run for the timing metrics.
+    :param stop_on_action (bool): True to return when the run requires an action (tool outputs).
+    :param initial_delay (float): The first delay between two refreshes in seconds.
+    :param max_delay (float): The maximum delay between two refreshes in seconds.
+    :param jitter (float): The random fraction added to every delay.
+    :param timer (PhaseTimer): The timer of the run phases.
+    :param sleep (Callable[[float], Awaitable]): The async sleep function.
+    :param clock (Callable[[], float]): The monotonic clock.
+
+    :return: The refreshed run object.
+    :raises RunTimeoutError: If the run is not finished before the timeout, after cancelling it.
+    """
+
+    start = clock()
+    deadline = start + timeout_seconds
+    delays = backoff_delays(initial_delay=initial_delay, max_delay=max_delay, jitter=jitter)
+
+    try:
+        while run.status not in TERMINAL_STATUSES and not (
+                stop_on_action and run.status == 'requires_action'):
+            remaining = deadline - clock()
+            if remaining <= 0:
+                await async_cancel_run(aclient=aclient, thread_id=thread_id, run_id=run.id)
+                timer.record(phase=phase, seconds=clock() - start, outcome='timeout')
+                raise RunTimeoutError(
+                    f"Run {run.id} was not finished after {timeout_seconds} seconds", run=run)
+
+            await sleep(min(next(delays), remaining))
+            run = await aclient.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+    except asyncio.CancelledError:
+        # the request was cancelled, the run must not keep the thread locked
+        await asyncio.shield(
+            async_cancel_run(aclient=aclient, thread_id=thread_id, run_id=run.id))
+        timer.record(phase=phase, seconds=clock() - start, outcome='cancelled')
+        raise
+
+    timer.record(phase=phase, seconds=clock() - start, outcome=run.status)
+    return run
+
+
+async def async_complete_run(
+        aclient=None,
+        run=None,
+        thread_id=None,
+        timeout_seconds=120,
+        phase='run',
+        dispatch=None,
+        max_tool_rounds=4):
+    """
+    This function completes a GPT assistant run with the async OpenAI client, submitting the
+    outputs of every tool round (see complete_run).
+
+    :param aclient (Optional[AsyncOpenAI]): The async OpenAI client.
+    :param run (Optional): The GPT assistant run object returned by runs.create.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param timeout_seconds (float): The maximum seconds to wait for each phase of the run.
+    :param phase (str): The phase name of the run for the timing metrics.
+    :param dispatch (Optional[Callable]): The function returning the output of each tool call.
+    :param max_tool_rounds (int): The maximum number of tool output submissions of the run.
+
+    :return Tuple: The completed run object, and the submit_tool_outputs object of the first
+    action of the run, or None.
+    :raises RunError: If the run is not completed, or still requires an action after
+    max_tool_rounds submissions (the run is cancelled).
+    """
+
+    run = await async_wait_for_run(
+        aclient=aclient, run=run, thread_id=thread_id, timeout_seconds=timeout_seconds,
+        phase=phase)
+
+    tool_value = None
+    rounds = 0
+    while run.status == 'requires_action':
+        if rounds >= max_tool_rounds:
+            await async_cancel_run(aclient=aclient, thread_id=thread_id, run_id=run.id)
+            raise RunError(
+                f"Run {run.id} still requires an action after {rounds} tool rounds", run=run)
+
+        submit_tool_outputs, tool_outputs = _tool_outputs(run=run, dispatch=dispatch)
+        if tool_value is None:
+            tool_value = submit_tool_outputs
+
+        # send the tool outputs back and wait for the next action or the end of the run
+        with run_timer.time(phase=phase + '.submit_tool_outputs'):
+            run = await aclient.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs)
+        run = await async_wait_for_run(
+            aclient=aclient, run=run, thread_id=thread_id, timeout_seconds=timeout_seconds,
+            phase=phase + '.after_tool_outputs')
+        rounds += 1
+
+    return ensure_completed(run), tool_value
+
+
+def message_text(messages=None):
+    """
+    This function returns the text of the newest assistant message of a page of thread messages
+    listed in descending order.
+
+    :param messages (Optional): The page of thread messages.
+
+    :return str: The text of the message, or an empty string if the page has no assistant message.
+    """
+
+    for message in messages.data:
+        if message.role == 'assistant':
+            return ''.join(part.text.value for part in message.content
+                           if getattr(part, 'text', None) is not None)
+    return ''
+
+
+def run_answer(client=None, thread_id=None, run=None, phase='run'):
+    """
+    This function retrieves the answer of a completed GPT assistant run: only its newest message
+    is listed, so the catalog and the older messages of the thread are not downloaded.
+
+    :param client (Optional[OpenAI]): The OpenAI client.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param run (Optional): The completed run object.
+    :param phase (str): The phase name of the run for the timing metrics.
+
+    :return str: The text of the answer, or an empty string if the run created no message.
+    """
+
+    with run_timer.time(phase=phase + '.messages'):
+        messages = client.beta.threads.messages.list(
+            thread_id=thread_id, run_id=run.id, limit=1, order='desc')
+    return message_text(messages=messages)
+
+
+async def async_run_answer(aclient=None, thread_id=None, run=None, phase='run'):
+    """
+    This function retrieves the answer of a completed GPT assistant run with the async OpenAI
+    client (see run_answer).
+
+    :param aclient (Optional[AsyncOpenAI]): The async OpenAI client.
+    :param thread_id (Optional[str]): The ID of the Assistant thread of the run.
+    :param run (Optional): The completed run object.
+    :param phase (str): The phase name of the run for the timing metrics.
+
+    :return str: The text of the answer, or an empty string if the run created no message.
+    """
+
+    with run_timer.time(phase=phase + '.messages'):
+        messages = await aclient.beta.threads.messages.list(
+            thread_id=thread_id, run_id=run.id, limit=1, order='desc')
+    return message_text(messages=messages)
@@ -0,0 +1,174 @@
+"""
+This semantic_cache.py code contains the local semantic response cache of the
+ShopBot API. The conversational turns that are not product queries (greetings,
+small talk, goodbyes) are embedded on the CPU as hashed vectors of their words
+and character trigrams, and the answers of the GPT assistant are kept in a
+bounded NumPy matrix. A new turn whose cosine similarity with a cached turn
+reaches the threshold is answered from the cache without any GPT run.
+"""
+
+import threading
+import zlib
+
+import numpy as np
+
+from catalog import tokenize
+from matcher import char_ngrams
+
+
+def hashed_vector(text=None, dim=1024):
+    """
+    This function embeds a text as an L2 normalized vector of hashed word and character trigram
+    counts. The hashes are stable between processes.
+
+    :param text (Optional[str]): The text to embed.
+    :param dim (int): The dimension of the vector.
+
+    :return np.ndarray: The float32 vector, all zeros for a text without tokens.
+    """
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        # the whole words weigh more than their trigrams
+        vector[zlib.crc32(('w:' + token).encode('utf-8')) % dim] += 2.0
+        for gram in char_ngrams(token=token):
+            vector[zlib.crc32(('c:' + gram).encode('utf-8')) % dim] += 1.0
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+class SemanticCache:
+    """
+    This class is a bounded semantic cache of the answers of the conversational turns, with a
+    cosine top-k search over the hashed vectors of the cached turns.
+    """
+
+    def __init__(
+            self,
+            max_size=512,
+            dim=1024,
+            threshold=0.9,
+            top_k=5,
+            max_chars=200):
+        """
+        :param max_size (int): The maximum number of cached turns, the least recently used turn
+        is replaced when it is exceeded; 0 disables the cache.
+        :param dim (int): The dimension of the hashed vectors.
+        :param threshold (float): The minimum cosine similarity of a cache hit.
+        :param top_k (int): The number of most similar turns checked for the scope of a lookup.
+        :param max_chars (int): The longest message cached; longer messages are rarely repeated.
+        """
+
+        self.max_size = max_size
+        self.dim = dim
+        self.threshold = threshold
+        self.top_k = top_k
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max(max_size, 1), dim), dtype=np.float32)
+        self._entries = []
+        self._last_used = np.zeros(max(max_size, 1), dtype=np.int64)
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _cacheable(self, text=None):
+        return self.enabled and bool(text) and len(text) <= self.max_chars
+
+    def get(self, text=None, scope=None):
+        """
+        This function returns the cached answer of the most similar turn of the same scope.
+
+        :param text (Optional[str]): The user message.
+        :param scope (Optional[str]): The branch of the turn ('bye' or 'fallback'), only the
+        turns of the same scope are shared.
+
+        :return Optional[str]: The cached answer, or None if no cached turn is similar enough.
+        """
+
+        if not self._cacheable(text):
+            return None
+        vector = hashed_vector(text=text, dim=self.dim)
+
+        with self._lock:
+            size = len(self._entries)
+            answer = None
+            if size and vector.any():
+                similarities = self._vectors[:size] @ vector
+                k = min(self.top_k, size)
+                candidates = np.argpartition(-similarities, k - 1)[:k]
+                for index in candidates[np.argsort(-similarities[candidates])]:
+                    if similarities[index] < self.threshold:
+                        break
+                    if self._entries[index][0] == scope:
+                        self._tick += 1
+                        self._last_used[index] = self._tick
+                        answer = self._entries[index][1]
+                        break
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def set(self, text=None, answer=None, scope=None):
+        """
+        This function stores the answer of a turn, replacing the least recently used turn if the
+        cache is full.
+
+        :param text (Optional[str]): The user message.
+        :param answer (Optional[str]): The answer of the GPT assistant.
+        :param scope (Optional[str]): The branch of the turn ('bye' or 'fallback'), only the
+        turns of the same scope are shared.
+        """
+
+        if not self._cacheable(text) or not answer:
+            return
+        vector = hashed_vector(text=text, dim=self.dim)
+        if not vector.any():
+            return
+
+        with self._lock:
+            if len(self._entries) < self.max_size:
+                index = len(self._entries)
+                self._entries.append((scope, answer))
+            else:
+                index = int(np.argmin(self._last_used))
+                self._entries[index] = (scope, answer)
+            self._vectors[index] = vector
+            self._tick += 1
+            self._last_used[index] = self._tick
+
+    def clear(self):
+        """
+        This function removes every cached turn.
+        """
+
+        with self._lock:
+            self._entries = []
+            self._vectors[:] = 0
+            self._last_used[:] = 0
+
+    def stats(self):
+        """
+        This function returns the counters of the cache.
+
+        :return dict: The hits, misses, hit ratio and size of the cache.
+        """
+
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'size': size}
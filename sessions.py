@@ -0,0 +1,287 @@
+"""
+This sessions.py code contains the per-session state registry of the ShopBot API.
+Every chatbot session opened in /ini gets a session token, and its state
+(username, Mock catalog, assistant and thread IDs, turns on the thread) is
+kept in a session store instead of module globals, so many conversations can
+be served at the same time and by several workers. The store backend is
+selected with a URL:
+
+- memory:// keeps the sessions in an in-process LRU/TTL cache (single worker).
+- sqlite:///path/to/sessions.db shares the sessions between workers of one host.
+- redis://host:port/db shares the sessions with a Redis-compatible server.
+"""
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+from caching import LRUTTLCache
+
+
+class ResourceRef:
+    """
+    This class is a lightweight reference to an OpenAI resource (assistant or thread)
+    that only holds its ID, as the API calls only need the ID of the objects.
+    """
+
+    __slots__ = ('id',)
+
+    def __init__(self, id=None):
+        self.id = id
+
+    def __repr__(self):
+        return f'<resource {self.id}>'
+
+
+class SessionState:
+    """
+    This class holds the state of a single chatbot session.
+    """
+
+    __slots__ = ('session_id', 'username', 'mock_products',
+                 'assistant_id', 'thread_id', 'thread_turns', 'turns')
+
+    def __init__(
+            self,
+            session_id=None,
+            username=None,
+            mock_products=None,
+            assistant_id=None,
+            thread_id=None,
+            thread_turns=0,
+            turns=0):
+        self.session_id = session_id
+        self.username = username
+        self.mock_products = mock_products
+        self.assistant_id = assistant_id
+        self.thread_id = thread_id
+        # turns with GPT runs on the thread since it was created (see thread compaction)
+        self.thread_turns = thread_turns or 0
+        # answered messages of the session
+        self.turns = turns or 0
+
+    @property
+    def assistant(self):
+        return ResourceRef(id=self.assistant_id)
+
+    @property
+    def thread(self):
+        return ResourceRef(id=self.thread_id)
+
+    def to_dict(self):
+        """
+        This function serializes the session state.
+
+        :return dict: The session state as a dictionary.
+        """
+
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data=None):
+        """
+        This function deserializes the session state.
+
+        :param data (Optional[dict]): The session state as a dictionary.
+
+        :return SessionState: The session state.
+        """
+
+        return cls(**{field: (data or {}).get(field)
+                      for field in cls.__slots__})
+
+    def __repr__(self):
+        return f'<session {self.session_id}>'
+
+
+class SessionStore:
+    """
+    This class is the base class of the session store backends.
+    """
+
+    def __init__(self, ttl_seconds=3600):
+        """
+        :param ttl_seconds (float): The time to live of the sessions since they were last saved.
+        """
+
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def new_session_id():
+        """
+        This function generates a new random session token.
+
+        :return str: The session token.
+        """
+
+        return secrets.token_urlsafe(24)
+
+    def get(self, session_id=None):
+        """
+        This function returns the state of a session.
+
+        :param session_id (Optional[str]): The session token.
+
+        :return Optional[SessionState]: The session state, or None if it is missing or expired.
+        """
+
+        if not session_id:
+            return None
+        data = self._load(session_id)
+        if data is None:
+            return None
+        return SessionState.from_dict(json.loads(data))
+
+    def save(self, state=None):
+        """
+        This function stores the state of a session and renews its time to live.
+
+        :param state (Optional[SessionState]): The session state.
+        """
+
+        self._store(state.session_id, json.dumps(state.to_dict()))
+
+    def delete(self, session_id=None):
+        """
+        This function removes a session.
+
+        :param session_id (Optional[str]): The session token.
+        """
+
+        self._remove(session_id)
+
+    def _load(self, session_id):
+        raise NotImplementedError
+
+    def _store(self, session_id, data):
+        raise NotImplementedError
+
+    def _remove(self, session_id):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    This class keeps the sessions in an in-process LRU/TTL cache.
+    """
+
+    def __init__(self, ttl_seconds=3600, max_sessions=10000):
+        """
+        :param ttl_seconds (float): The time to live of the sessions since they were last saved.
+        :param max_sessions (int): The maximum number of sessions kept in memory.
+        """
+
+        super().__init__(ttl_seconds=ttl_seconds)
+        self._cache = LRUTTLCache(max_size=max_sessions, ttl_seconds=ttl_seconds)
+
+    def _load(self, session_id):
+        return self._cache.get(session_id)
+
+    def _store(self, session_id, data):
+        self._cache.set(session_id, data)
+
+    def _remove(self, session_id):
+        self._cache.pop(session_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    This class keeps the sessions in a SQLite database shared by the workers of a host.
+    """
+
+    def __init__(self, path='./sessions.db', ttl_seconds=3600):
+        """
+        :param path (str): The path of the SQLite database file.
+        :param ttl_seconds (float): The time to live of the sessions since they were last saved.
+        """
+
+        super().__init__(ttl_seconds=ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _connection(self):
+        # one connection per thread, as sqlite3 connections are not shared
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _load(self, session_id):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE session_id = ? AND expires > ?",
+            (session_id, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def _store(self, session_id, data):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, expires) VALUES (?, ?, ?)",
+                (session_id, data, time.time() + self.ttl_seconds))
+            # drop the expired sessions on the way
+            connection.execute(
+                "DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+
+    def _remove(self, session_id):
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class RedisSessionStore(SessionStore):
+    """
+    This class keeps the sessions in a Redis-compatible server, shared by every worker.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', ttl_seconds=3600):
+        """
+        :param url (str): The URL of the Redis-compatible server.
+        :param ttl_seconds (float): The time to live of the sessions since they were last saved.
+        """
+
+        # redis is only required when this backend is selected
+        import redis
+
+        super().__init__(ttl_seconds=ttl_seconds)
+        self._redis = redis.Redis.from_url(url)
+
+    def _key(self, session_id):
+        return 'shopbot:session:' + session_id
+
+    def _load(self, session_id):
+        data = self._redis.get(self._key(session_id))
+        return None if data is None else data.decode('utf-8')
+
+    def _store(self, session_id, data):
+        self._redis.set(self._key(session_id), data,
+                        ex=int(self.ttl_seconds))
+
+    def _remove(self, session_id):
+        self._redis.delete(self._key(session_id))
+
+
+def make_session_store(url='memory://', ttl_seconds=3600):
+    """
+    This function creates the session store backend given by a URL.
+
+    :param url (str): 'memory://', 'sqlite:///path/to/sessions.db' or 'redis://host:port/db'.
+    :param ttl_seconds (float): The time to live of the sessions since they were last saved.
+
+    :return SessionStore: The session store.
+    """
+
+    if url.startswith('memory://'):
+        return MemorySessionStore(ttl_seconds=ttl_seconds)
+    if url.startswith('sqlite:///'):
+        return SQLiteSessionStore(
+            path=url[len('sqlite:///'):], ttl_seconds=ttl_seconds)
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisSessionStore(url=url, ttl_seconds=ttl_seconds)
+    raise ValueError(f"Unsupported session store: {url}")
@@ -0,0 +1,542 @@
+"""
+This shopbot_tools.py code contains the GPT tool definitions and the helper
+functions shared by the Flask (app.py) and asyncio (app_async.py) versions of
+the ShopBot API: the assistant definition, the parsing of the tool calls, the
+HTML formatting of the answers and the rows of the interaction log. None of
+these functions calls the OpenAI API or the database.
+"""
+
+import datetime
+import json
+import random
+import string
+
+from catalog import Catalog
+from models_database import to_price, to_stock
+
+# definition of the GPT assistant shared by every chatbot session
+ASSISTANT_NAME = "Shopping Bot Assistant"
+ASSISTANT_INSTRUCTIONS = "You are a helpful AI ShopBot assistant. You will give me adequate prompts for giving a good service in a shopping context. Use the provided functions to answer questions. Generate function outputs (in tools) depending on the received messages"
+ASSISTANT_MODEL = "gpt-4o"
+
+# instructions of the runs that force a tool call
+RUN_INSTRUCTIONS = "Give priority to this client! Return the tools that are activated by the user message"
+
+# instructions of the completion summarizing a thread before it is compacted
+COMPACTION_INSTRUCTIONS = "Summarize this conversation between a client and a ShopBot assistant in a few sentences. Keep the products the client asked for, their prices and stock, and any open question of the client. Do not include the JSON catalog."
+
+# tools definition for association functions to the query
+tools = [
+    {
+        "type": "function",
+        "function": {
+                "name": "getProductInfo",
+                "description": "Give the product_name value described in the JSON input catalog that contains any string in the text after 'user: '",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "productName": {
+                            "type": "string",
+                            "description": "The complete product_name value given in the JSON input catalog that contains any string given after 'user: '. If any string after 'user: ' is NOT contained in any product_name this value MUST BE 'null'! The query should be returned in plain text, not in JSON.",
+                        }
+                    },
+                    "required": ["productName"],
+                },
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "checkStock",
+            "description": "Give the single stock_avail value associated with the user input. This is NOT the product_name! Only the stock_avail value.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "checkValue": {
+                        "type": "string",
+                        "description": "The value of stock_avail associated with the product given in the text after 'user: '. This is NOT the product_name! Only the stock_avail value.",
+                    }
+                },
+                "required": ["checkValue"],
+            },
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "getInformation",
+            "description": "Give the description and prices values associated with the user input. This is NOT the product_name! Only the information required.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "price": {
+                        "type": "string",
+                        "description": "The value of price associated with the product given in the text after 'user: '. This is NOT the product_name! Only give the associated price value! The query should be returned in plain text."
+                    },
+                    "description_val": {
+                        "type": "string",
+                        "description": "The value of description associated with the product given in the text after 'user: '. This is NOT the product_name! Only give the associated description value! The query should be returned in plain text."
+                    },
+                },
+                "required": ["price", "description_val"],
+            },
+        }
+    }
+]
+
+
+def catalog_run_instructions(catalog_mode='pinned'):
+    """
+    This function returns the instructions of the runs that force a tool call. In the 'pinned'
+    catalog mode the instructions point to the catalog attached at the beginning of the thread.
+
+    :param catalog_mode (str): The catalog mode, 'pinned' or 'per_turn'.
+
+    :return str: The run instructions.
+    """
+
+    if catalog_mode == 'pinned':
+        return RUN_INSTRUCTIONS + \
+            ". The JSON input catalog is the one given at the beginning of this thread."
+    return RUN_INSTRUCTIONS
+
+
+def single_run_instructions(catalog_mode='pinned'):
+    """
+    This function returns the instructions of the single run resolving the product intent and
+    its information with parallel tool calls.
+
+    :param catalog_mode (str): The catalog mode, 'pinned' or 'per_turn'.
+
+    :return str: The run instructions.
+    """
+
+    return catalog_run_instructions(catalog_mode=catalog_mode) + \
+        ". Always call getProductInfo and, if the text after 'user: ' refers to a product of the" \
+        " JSON input catalog, call getInformation and checkStock for it too, all in parallel."
+
+
+def catalog_message_content(mock_products=None):
+    """
+    This function returns the content of the thread message carrying the JSON catalog.
+
+    :param mock_products (Optional[str]): A JSON string representing the Mock catalog of products.
+
+    :return str: The message content.
+    """
+
+    return "The JSON input catalog is: " + mock_products + " \n"
+
+
+def should_compact(prompt_tokens=0, thread_turns=0, max_tokens=0, max_turns=0):
+    """
+    This function checks if the thread of a session must be compacted after a turn.
+
+    :param prompt_tokens (int): The prompt tokens of the GPT runs of the last turn.
+    :param thread_turns (int): The number of turns with GPT runs on the thread.
+    :param max_tokens (int): The prompt tokens of a turn that trigger the compaction, 0 disables it.
+    :param max_turns (int): The number of turns that trigger the compaction, 0 disables it.
+
+    :return bool: True if the thread must be compacted.
+    """
+
+    return bool((max_tokens and prompt_tokens >= max_tokens) or (max_turns and thread_turns >= max_turns))
+
+
+def compaction_messages(history=None, max_chars=600):
+    """
+    This function returns the chat messages of the completion summarizing a thread. The catalog
+    messages are left out, the new thread gets the catalog again.
+
+    :param history (Optional[List[Tuple[str, str]]]): The (role, text) of the thread messages,
+    oldest first.
+    :param max_chars (int): The longest text kept of every message.
+
+    :return List[dict]: The chat messages of the completion.
+    """
+
+    catalog_prefix = catalog_message_content(mock_products='').strip()
+    lines = []
+    for role, text in history or []:
+        if not text or text.startswith(catalog_prefix):
+            continue
+        if role == 'assistant':
+            text = 'ShopBot: ' + text
+        elif not text.startswith('user: '):
+            text = 'user: ' + text
+        lines.append(text[:max_chars])
+    transcript = '\n'.join(lines)
+    return [
+        {"role": "system", "content": COMPACTION_INSTRUCTIONS},
+        {"role": "user", "content": transcript}]
+
+
+def summary_message_content(summary=None):
+    """
+    This function returns the content of the message seeding a compacted thread with the summary
+    of the previous conversation.
+
+    :param summary (Optional[str]): The summary of the previous thread.
+
+    :return str: The message content.
+    """
+
+    return "Summary of the previous conversation with this client: " + str(summary or '') + " \n"
+
+
+def thread_history(messages=None):
+    """
+    This function returns the text of the messages of a thread, oldest first.
+
+    :param messages (Optional): The page of thread messages listed in descending order.
+
+    :return List[Tuple[str, str]]: The (role, text) of every message.
+    """
+
+    history = []
+    for message in reversed(list(messages.data)):
+        text = ''.join(part.text.value for part in message.content
+                       if getattr(part, 'text', None) is not None)
+        history.append((message.role, text))
+    return history
+
+
+def tool_completion_messages(mock_products=None, product_name=None):
+    """
+    This function returns the chat messages of a completion forcing a product tool call
+    (getInformation or checkStock) outside of the Assistant thread.
+
+    :param mock_products (Optional[str]): A JSON string representing the Mock catalog of products.
+    :param product_name (Optional[str]): The name of the queried product.
+
+    :return List[dict]: The chat messages of the completion.
+    """
+
+    return [
+        {"role": "system", "content": ASSISTANT_INSTRUCTIONS + " " + RUN_INSTRUCTIONS},
+        {"role": "user", "content": catalog_message_content(mock_products=mock_products)},
+        {"role": "user", "content": "user: " + product_name}]
+
+
+def checkStock(stock_value=None, catalog=None):
+    """
+    This functiomn Determines stock availability of a specified product based on GPT tool
+    call information and mock product data.
+
+    This function inspects the GPT model's tool call response to determine if a stock check
+    is required. If the model response provides a 'checkValue', it validates against the mock
+    product list. Returns a stock availability message and the stock status.
+
+    :param stock_value (Optional): A model response object that may contain tool calls, including
+    the product's stock check information.
+    :param catalog (Optional): The parsed Catalog object of the session, where each product
+    contains information such as `product_name` and 'stock_avail'.
+
+    :return:  Tuple[str, str]: A tuple containing:
+    - stock_availability_string: A formatted HTML string indicating stock availability status.
+    - tool_stock_value: A string representing the stock status ('true' if available, 'false' if not).
+    """
+    # determine if the response from the model includes a tool call.
+    tool_stock = stock_value.tool_calls
+
+    if tool_stock:
+        # If true the model will return the name of the tool / function to call
+        # and the argument(s)
+        tool_stock[0].id
+        tool_stock[0].function.name
+        tool_stock_value = json.loads(
+            tool_stock[0].function.arguments)['checkValue']
+
+    # double validation of the GPT ack
+    if str(tool_stock_value).lower() != 'true' and str(
+            tool_stock_value).lower() != 'false':
+        # read the values from the catalog name index
+        product = catalog.get(product_name=tool_stock_value)
+
+        if product is not None:
+            tool_stock_value = str(product.stock_avail)
+
+    stock_availability_string = format_stock(stock_avail=tool_stock_value)
+
+    return stock_availability_string, tool_stock_value
+
+
+def format_stock(stock_avail=None):
+    """
+    This function formats the stock availability value as the HTML string shown in the chatbot.
+
+    :param stock_avail (Optional[str]): The stock_avail value ('true' if available, 'false' if not).
+
+    :return str: A formatted HTML string indicating stock availability status.
+    """
+
+    if str(stock_avail).lower() == 'true':
+        return "<b>** This product is on stock! **</b><br>"
+    return "<b>** This product is out of stock! **</b><br>"
+
+
+def getInformation(info_values=None):
+    """
+    This function retrieves product information based on GPT tool call data with the function getInformation.
+    This function also examines the model's response to check if it includes a tool call containing
+    product information, such as price and description. If found, it extracts these details
+    and formats them into an HTML string.
+
+    :params info_values (Optional): An object representing the model's response that may contain
+    tool calls, which include details like product price and description.
+
+    :return: Tuple[str, str, str]: A tuple containing:
+    - info_string: A formatted HTML string displaying the product price and description.
+    - tool_info_price: A string representing the product price.
+    - tool_info_description: A string representing the product description.
+    """
+
+    # determine if the response from the model includes a tool call.
+    tool_info = info_values.tool_calls
+
+    if tool_info:
+        # If true the model will return the name of the tool / function to call
+        # and the argument(s)
+        tool_info[0].id
+        tool_info[0].function.name
+        tool_info_price = json.loads(tool_info[0].function.arguments)['price']
+        tool_info_description = json.loads(
+            tool_info[0].function.arguments)['description_val']
+
+    info_string = format_information(
+        price=tool_info_price, description=tool_info_description)
+
+    return info_string, tool_info_price, tool_info_description
+
+
+def format_information(price=None, description=None):
+    """
+    This function formats the product price and description as the HTML string shown in the chatbot.
+
+    :param price (Optional[str]): The product price.
+    :param description (Optional[str]): The product description.
+
+    :return str: A formatted HTML string displaying the product price and description.
+    """
+
+    return "<b>Price:</b> " + str(price) + " USD <br>" + \
+        "<b>Description:</b> " + str(description) + "<br>"
+
+
+def extract_product_names_values(json_values=None, catalog=None):
+    """
+    This function Extracts product_name values from the Mock catalog and formats them
+    as a string for display.
+
+    The HTML string and the list of product names are precomputed when the Catalog object
+    is built, so this function only parses the JSON string if no catalog is given.
+
+    :params json_values (Optional): A JSON string representing a list of product dictionaries,
+    where each dictionary contains a 'product_name' key.
+    :params catalog (Optional): The parsed Catalog object of the session.
+
+    :return Tuple[str, List[str]]: A tuple containing:
+    - string_value: A formatted HTML string with product names for display.
+    - product_names: A list of product names extracted from the catalog.
+    """
+
+    if catalog is None:
+        catalog = Catalog.from_json(mock_products=json_values)
+
+    return catalog.product_list_html, list(catalog.names)
+
+
+def strip_punctuation(text=None):
+    """
+    This function removes the punctuation of the user message before matching product names.
+
+    :param text (Optional[str]): The user message.
+
+    :return str: The user message without '?', '!', '.' and ','.
+    """
+
+    text_sub = text.replace('?', '')
+    text_sub = text_sub.replace('!', '')
+    text_sub = text_sub.replace('.', '')
+    text_sub = text_sub.replace(',', '')
+    return text_sub
+
+
+def parse_product_intent(text=None, tool_value_returned=None):
+    """
+    This function extracts the product_name of a getProductInfo tool call and validates it against
+    the user message.
+
+    :param text (Optional[str]): The user message.
+    :param tool_value_returned (Optional): The submit_tool_outputs object of the getProductInfo run.
+
+    :return Optional[str]: The product_name found in the user message, 'null' if the tool value is
+    not in the message, or None if the run did not call the tool.
+    """
+
+    # determine if the response from the model includes a tool call.
+    tool_calls = getattr(tool_value_returned, 'tool_calls', None)
+    tool_value = None
+
+    if tool_calls:
+        # If true the model will return the name of the tool / function to call
+        # and the argument(s)
+        tool_value = validate_product_name(
+            text=text,
+            product_name=json.loads(tool_calls[0].function.arguments)['productName'])
+
+    return tool_value
+
+
+def validate_product_name(text=None, product_name=None):
+    """
+    This function validates the product_name returned by the getProductInfo tool against the
+    user message (double validation of the GPT ack).
+
+    :param text (Optional[str]): The user message.
+    :param product_name (Optional[str]): The productName argument of the tool call.
+
+    :return str: The product_name if any word of the user message is in it, 'null' otherwise.
+    """
+
+    text_split = strip_punctuation(text=text).split(" ")
+
+    if product_name != 'null' and not (product_name is None):
+        for index in range(0, len(text_split)):
+            if text_split[index] in product_name.lower():
+                return product_name
+
+    return 'null'
+
+
+class ToolDispatcher:
+    """
+    This class handles every tool call of a run that may call several tools in parallel
+    (getProductInfo, getInformation and checkStock in a single run). It is passed as the
+    dispatch function of runs.complete_run: it keeps the arguments of each tool and returns
+    the output submitted for each tool call.
+    """
+
+    def __init__(self, catalog=None):
+        """
+        :param catalog (Optional[Catalog]): The parsed Catalog object of the session, used to
+        validate the checkStock value.
+        """
+
+        self.catalog = catalog
+        self.arguments = {}
+
+    def __call__(self, tool_call=None):
+        """
+        This function handles one tool call of the run.
+
+        :param tool_call (Optional): The tool call object of submit_tool_outputs.tool_calls.
+
+        :return str: The output of the tool call.
+        """
+
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+        except (TypeError, ValueError):
+            arguments = {}
+        # the first call of each tool is kept if the model repeats it
+        self.arguments.setdefault(tool_call.function.name, arguments)
+        return ""
+
+    def product_name(self, text=None):
+        """
+        This function returns the product_name of the getProductInfo call, validated against the
+        user message.
+
+        :param text (Optional[str]): The user message.
+
+        :return Optional[str]: The product_name, 'null' if it is not in the message, or None if
+        getProductInfo was not called.
+        """
+
+        if 'getProductInfo' not in self.arguments:
+            return None
+        return validate_product_name(
+            text=text, product_name=self.arguments['getProductInfo'].get('productName'))
+
+    def product_fields(self):
+        """
+        This function returns the product fields of the getInformation and checkStock calls.
+
+        :return Optional[Tuple[str, str, str]]: The price, description and stock_avail values, or
+        None if any of both tools was not called.
+        """
+
+        information = self.arguments.get('getInformation')
+        stock = self.arguments.get('checkStock')
+        if not information or not stock or 'price' not in information:
+            return None
+
+        stock_avail = stock.get('checkValue')
+        # double validation of the GPT ack
+        if str(stock_avail).lower() not in ('true', 'false') and self.catalog is not None:
+            product = self.catalog.get(product_name=stock_avail)
+            if product is not None:
+                stock_avail = str(product.stock_avail)
+
+        return information.get('price'), information.get('description_val'), stock_avail
+
+
+def build_registers(
+        username=None,
+        text=None,
+        response_text=None,
+        product_query=False,
+        product_name=None,
+        price=None,
+        description=None,
+        stock_avail=None,
+        session_id=None,
+        usage=None):
+    """
+    This function builds the rows of the interaction log of a chat message.
+
+    :param username (Optional[str]): The username of the chatbot session.
+    :param text (Optional[str]): The user message.
+    :param response_text (Optional[str]): The ShopBot answer.
+    :param product_query (bool): True if the message was a successful product query.
+    :param product_name (Optional[str]): The queried product name.
+    :param price (Optional[str]): The product price.
+    :param description (Optional[str]): The product description.
+    :param stock_avail (Optional[str]): The product stock availability.
+    :param session_id (Optional[str]): The ID of the chatbot session.
+    :param usage (Optional[dict]): The tokens and cost of the message, see TokenMeter.end_turn.
+
+    :return Tuple[dict, Optional[dict]]: The column values of the ShopData row, and of the
+    ShopData_Product row if the message was a product query. The ids are generated by the database.
+    """
+
+    # get the time just after the query is done
+    time_now = datetime.datetime.now(datetime.timezone.utc)
+
+    # Code generator
+    code_str = ''.join(random.choice(string.ascii_letters)
+                       for i in range(16))
+
+    register = dict(
+        code=code_str,
+        date=time_now,
+        username=username,
+        Interaction="user: " + text + ", ShopBot: " + response_text,
+        session_id=session_id,
+        prompt_tokens=None if usage is None else usage['prompt_tokens'],
+        completion_tokens=None if usage is None else usage['completion_tokens'],
+        token_cost=None if usage is None else round(usage['cost_usd'], 6))
+
+    register_product = None
+    if product_query is True:
+        register_product = dict(
+            code=code_str,
+            date=time_now,
+            username=username,
+            product_name=product_name,
+            price=to_price(price),
+            description=description,
+            stock_availability=to_stock(stock_avail))
+
+    return register, register_product
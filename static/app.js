@@ -1,6 +1,8 @@
 var server = []
 var user_global=[]
 var file_global=[]
+var session_global=null
+var stream_global=false
 
 let btnLogin = document.querySelector('.btn_login')
 
@@ -90,6 +92,7 @@ class Chatbox {
             chatbox.classList.add('chatbox--active')
             fetch(server+'/ini', {
             method: 'POST',
+            body: JSON.stringify({ user: user_global }),
             mode: 'cors',
             headers: {
               'Content-Type': 'application/json'
@@ -97,6 +100,9 @@ class Chatbox {
           })
           .then(r => r.json())
           .then(r => {
+          session_global = r.session_id;
+          // /ini tells if the API streams the answers from /predict/stream
+          stream_global = r.stream === true;
           let msg_ini = { name: "User", message: r.answer };
           this.messages.push(msg_ini);
           this.updateChatText(chatbox,0);
@@ -136,9 +142,27 @@ class Chatbox {
         this.updateChatText(chatbox,1)
 
 
+        // stream the answer from /predict/stream if the API streams, or take it
+        // whole from /predict
+        if (stream_global) {
+            let response = await fetch(server+'/predict/stream', {
+                method: 'POST',
+                body: JSON.stringify({ message: text1, session_id: session_global }),
+                mode: 'cors',
+                headers: {
+                  'Content-Type': 'application/json'
+                },
+              }).catch((error) => null);
+
+            if (response && response.ok && (response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+                await this.readStream(chatbox, response);
+                return;
+            }
+        }
+
         await fetch(server+'/predict', {
             method: 'POST',
-            body: JSON.stringify({ message: text1 }),
+            body: JSON.stringify({ message: text1, session_id: session_global }),
             mode: 'cors',
             headers: {
               'Content-Type': 'application/json'
@@ -148,24 +172,123 @@ class Chatbox {
            .then(r => {
             let msg2 = { name: "User", message: '<b>ShopBot</b>: ' + r.answer };
             this.messages.push(msg2);
-            this.updateChatText(chatbox,0)
-            textField.value = ''
+            this.showAnswer(chatbox, r);
+        }).catch((error) => {
+            console.error('Error:', error);
+            this.enableInput(chatbox);
+          });
+    }
 
-            var imgEl = document.getElementById("img_input");
 
-            imgEl.src = r.file_name;
-            imgEl.style.display = "block";
-            r.file_name
-            document.querySelector('.send__button').disabled = false;
-            document.querySelector('.chatbox__support').disabled = false;
-            chatbox.querySelector('input').disabled = false;
+    async readStream(chatbox, response) {
+        // the answer is rendered while the text deltas arrive as server-sent events
+        let msg2 = { name: "User", message: '<b>ShopBot</b>: ' };
+        let answer = '';
+        let done = false;
+        this.messages.push(msg2);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        try {
+            while (!done) {
+                const { value, done: closed } = await reader.read();
+                if (closed) {
+                    break;
+                }
+                buffer += decoder.decode(value, { stream: true });
+
+                let index;
+                while ((index = buffer.indexOf('\n\n')) >= 0) {
+                    const block = buffer.slice(0, index);
+                    buffer = buffer.slice(index + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    block.split('\n').forEach(function(line) {
+                        if (line.startsWith('event:')) {
+                            event = line.slice(6).trim();
+                        } else if (line.startsWith('data:')) {
+                            data += line.slice(5).trim();
+                        }
+                    });
+                    if (!data) {
+                        continue;
+                    }
+                    const payload = JSON.parse(data);
+
+                    if (event === 'delta') {
+                        answer += payload.text;
+                        msg2.message = '<b>ShopBot</b>: ' + answer;
+                        this.updateChatText(chatbox,0);
+                    } else if (event === 'done') {
+                        msg2.message = '<b>ShopBot</b>: ' + payload.answer;
+                        this.showAnswer(chatbox, payload);
+                        done = true;
+                    } else if (event === 'error') {
+                        msg2.message = '<b>ShopBot</b>: ' + payload.answer;
+                        this.updateChatText(chatbox,0);
+                        done = true;
+                    }
+                }
+            }
+        } catch (error) {
+            console.error('Error:', error);
+        }
 
+        if (!done) {
+            this.updateChatText(chatbox,0);
+        }
+        this.enableInput(chatbox);
+    }
 
-        }).catch((error) => {
-            console.error('Error:', error);
-            this.updateChatText(chatbox,0)
-            textField.value = ''
-          });
+
+    showAnswer(chatbox, r) {
+        this.updateChatText(chatbox,0)
+
+        var imgEl = document.getElementById("img_input");
+
+        imgEl.src = r.file_name;
+        imgEl.style.display = "block";
+
+        // the product image is fetched in background, swap it in when ready
+        if (r.image_key) {
+            this.pollImage(r.image_key, 20);
+        }
+        this.enableInput(chatbox);
+    }
+
+
+    enableInput(chatbox) {
+        chatbox.querySelector('input').value = ''
+        document.querySelector('.send__button').disabled = false;
+        document.querySelector('.chatbox__support').disabled = false;
+        chatbox.querySelector('input').disabled = false;
+    }
+
+
+    pollImage(key, attempts) {
+        if (attempts <= 0) {
+            return;
+        }
+
+        setTimeout(() => {
+            fetch(server+'/image/'+key, {
+                method: 'GET',
+                mode: 'cors',
+              })
+              .then(r => r.json())
+              .then(r => {
+                if (r.ready) {
+                    document.getElementById("img_input").src = r.file_name;
+                } else {
+                    this.pollImage(key, attempts - 1);
+                }
+              }).catch((error) => {
+                console.error('Error:', error);
+              });
+        }, 1000);
     }
 
 